@@ -51,7 +51,14 @@ H0 = littleh * 100 * u.km/u.s/u.Mpc
 good_ids = np.where(my_subs > -1)[0]
 my_profiles = {}
 
-for sub_id in my_subs[good_ids]:
+if args.local:
+    reader = readhaloHDF5.SnapshotHaloReader(args.local, snapnum, long_ids=True,
+                                             double_output=False)
+
+    gas_sweep = reader.iter_subhalos(0, my_subs[good_ids], ["POS ", "RHO ", "MASS", "U   ", "NE  "],
+                                     out={}, dtype="float32")
+
+for sub_id in np.sort(my_subs[good_ids]):
 
     my_profiles[sub_id] = {}
 
@@ -79,28 +86,16 @@ for sub_id in my_subs[good_ids]:
             gas = False
 
     else:
-        readhaloHDF5.reset()
-
-        try:
-            # Gas
-            coords = readhaloHDF5.readhalo(args.local, "snap", snapnum, 
-                                           "POS ", 0, -1, sub_id, long_ids=True,
-                                           double_output=False).astype("float32")
-            dens = readhaloHDF5.readhalo(args.local, "snap", snapnum, 
-                                         "RHO ", 0, -1, sub_id, long_ids=True,
-                                         double_output=False).astype("float32")
-            mass = readhaloHDF5.readhalo(args.local, "snap", snapnum, 
-                                         "MASS", 0, -1, sub_id, long_ids=True,
-                                         double_output=False).astype("float32")
-            inte = readhaloHDF5.readhalo(args.local, "snap", snapnum, 
-                                         "U   ", 0, -1, sub_id, long_ids=True,
-                                         double_output=False).astype("float32")
-            elec = readhaloHDF5.readhalo(args.local, "snap", snapnum,
-                                         "NE  ", 0, -1, sub_id, long_ids=True,
-                                         double_output=False).astype("float32")
-
-        except AttributeError:
+        # Gas
+        gas_data = readhaloHDF5.next_subhalo(gas_sweep, sub_id)
+        if gas_data is None:
             gas = False
+        else:
+            coords = gas_data["POS "]
+            dens = gas_data["RHO "]
+            mass = gas_data["MASS"]
+            inte = gas_data["U   "]
+            elec = gas_data["NE  "]
 
 
     if gas:
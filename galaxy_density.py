@@ -25,11 +25,10 @@ if rank==0:
         
         if args.local:
             subs = np.array([sub['id'] for sub in cut1['results']], dtype='i')
-            cat = readsubfHDF5.subfind_catalog(args.local, snapnum,
-                                               keysel=['SubhaloPos','SubhaloMass'])
+            cat = readsubfHDF5.lazy_subfind_catalog(args.local, snapnum)
             sub_dat = np.hstack(( subs.reshape(subs.size,1), 
-                                  cat.SubhaloMass[subs].reshape(subs.size,1),
-                                  cat.SubhaloPos[subs] ))
+                                  cat.get_rows('SubhaloMass', subs).reshape(subs.size,1),
+                                  cat.get_rows('SubhaloPos', subs) ))
             del cat
 
         else:
@@ -40,10 +40,11 @@ if rank==0:
     sub_ids = np.array([sub['id'] for sub in cut1['results']], dtype='i')
 
     if args.local:
-        cat = readsubfHDF5.subfind_catalog(args.local, snapnum, #grpcat=False, subcat=False,
-                                           keysel=['GroupFirstSub','SubhaloGrNr'])
-        sat = np.zeros(cat.SubhaloGrNr.size, dtype=bool)
-        sat[sub_ids] = (sub_ids != cat.GroupFirstSub[cat.SubhaloGrNr[sub_ids]])
+        # only the rows of our subhalos and their groups are read
+        cat = readsubfHDF5.lazy_subfind_catalog(args.local, snapnum)
+        sat = np.zeros(cat.nsubs, dtype=bool)
+        grnr = cat.get_rows('SubhaloGrNr', sub_ids)
+        sat[sub_ids] = (sub_ids != cat.get_rows('GroupFirstSub', grnr))
         del cat
         gc.collect()
 
@@ -66,7 +67,16 @@ H0 = littleh * 100 * u.km/u.s/u.Mpc
 good_ids = np.where(my_subs > -1)[0]
 my_profiles = {}
 
-for sub_id in my_subs[good_ids]:
+if args.local:
+    reader = readhaloHDF5.SnapshotHaloReader(args.local, snapnum, long_ids=True,
+                                             double_output=False)
+
+    gas_sweep = reader.iter_subhalos(0, my_subs[good_ids], ["POS ", "VEL ", "RHO ", "MASS", "U   ", "NE  ", "GCOL"],
+                                     out={}, dtype="float32")
+    star_sweep = reader.iter_subhalos(4, my_subs[good_ids], ["POS ", "VEL ", "MASS", "GAGE"],
+                                      out={}, dtype="float32")
+
+for sub_id in np.sort(my_subs[good_ids]):
 
     my_profiles[sub_id] = {}
 
@@ -98,75 +108,38 @@ for sub_id in my_subs[good_ids]:
         raise NotImplementedError("Cutouts not updated to include required info")
     
     else: # use local dataset instead of api-downloaded cutouts
-        readhaloHDF5.reset()
-
-        # dm_coords = readhaloHDF5.readhalo(args.local, "snap", snapnum,
-        #                                   "POS ", 1, -1, sub_id, long_ids=True,
-        #                                   double_output=False).astype("float32")
-        # dm_mass = readhaloHDF5.readhalo(args.local, "snap", snapnum,
-        #                                 "MASS", 1, -1, sub_id, long_ids=True,
-        #                                 double_output=False).astype("float32")
+        # dm_coords = reader.read("POS ", 1, -1, sub_id, dtype="float32")
+        # dm_mass = reader.read("MASS", 1, -1, sub_id, dtype="float32")
         
-        try:
-            # Gas
-            coords = readhaloHDF5.readhalo(args.local, "snap", snapnum, 
-                                           "POS ", 0, -1, sub_id, long_ids=True,
-                                           double_output=False).astype("float32")
-            
-            vel = readhaloHDF5.readhalo(args.local, "snap", snapnum,
-                                        "VEL ", 0, -1, sub_id, long_ids=True,
-                                        double_output=False).astype("float32")
-            
-            dens = readhaloHDF5.readhalo(args.local, "snap", snapnum, 
-                                         "RHO ", 0, -1, sub_id, long_ids=True,
-                                         double_output=False).astype("float32")
-            
-            mass = readhaloHDF5.readhalo(args.local, "snap", snapnum, 
-                                         "MASS", 0, -1, sub_id, long_ids=True,
-                                         double_output=False).astype("float32")
-            
-            inte = readhaloHDF5.readhalo(args.local, "snap", snapnum, 
-                                         "U   ", 0, -1, sub_id, long_ids=True,
-                                         double_output=False).astype("float32")
-            
-            elec = readhaloHDF5.readhalo(args.local, "snap", snapnum,
-                                         "NE  ", 0, -1, sub_id, long_ids=True,
-                                         double_output=False).astype("float32")
-
-            cool_rate = readhaloHDF5.readhalo(args.local, "snap", snapnum,
-                                              "GCOL", 0, -1, sub_id, long_ids=True,
-                                              double_output=False).astype("float32")
-            
-        except AttributeError:
+        # Gas
+        gas_data = readhaloHDF5.next_subhalo(gas_sweep, sub_id)
+        if gas_data is None:
             gas = False
+        else:
+            coords = gas_data["POS "]
+            vel = gas_data["VEL "]
+            dens = gas_data["RHO "]
+            mass = gas_data["MASS"]
+            inte = gas_data["U   "]
+            elec = gas_data["NE  "]
+            cool_rate = gas_data["GCOL"]
 
 
         # Stars
-        try:
-            scoords = readhaloHDF5.readhalo(args.local, "snap", snapnum, 
-                                            "POS ", 4, -1, sub_id, long_ids=True,
-                                            double_output=False).astype("float32")
-            
-            svel = readhaloHDF5.readhalo(args.local, "snap", snapnum,
-                                         "VEL ", 4, -1, sub_id, long_ids=True,
-                                         double_output=False).astype("float32")
-            
-            smass = readhaloHDF5.readhalo(args.local, "snap", snapnum, 
-                                          "MASS", 4, -1, sub_id, long_ids=True,
-                                          double_output=False).astype("float32")
-            
-            a_form = readhaloHDF5.readhalo(args.local, "snap", snapnum, 
-                                           "GAGE", 4, -1, sub_id, long_ids=True,
-                                           double_output=False).astype("float32")
+        star_data = readhaloHDF5.next_subhalo(star_sweep, sub_id)
+        if star_data is None:
+            stars = False
+        else:
+            scoords = star_data["POS "]
+            svel = star_data["VEL "]
+            smass = star_data["MASS"]
+            a_form = star_data["GAGE"]
 
             # filter out wind particles
             star_filter = a_form > 0
             scoords = scoords[star_filter]
             svel = svel[star_filter]
             smass = smass[star_filter]
-            
-        except AttributeError:
-            stars = False
 
     #
     # Calculate r200 and other virial quantities
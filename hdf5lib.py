@@ -31,8 +31,34 @@
 #----> this will load the specified interface; modules loaded later (like snapHDF5.py, etc.) will then use the specified interface
 #
 #
+#files opened read-only are kept open in a pool of the pool_size most recently used handles,
+#shared by snapHDF5, readsubfHDF5, readhaloHDF5 and mergertreeHDF5 and safe to use from several
+#threads; close() on such a handle leaves it in the pool, a handle is only closed once no caller
+#uses it any more, and a pooled file is reopened when it was rewritten on disk. Opening a file
+#for writing (mode "w", "a", "r+") raises IOError while a pooled read handle of it is still in
+#use (not yet closed), as PyTables/HDF5 would refuse the write open or the readers would see a
+#file changing under them; pooled handles can be used in with blocks like the file itself. Size and HDF5
+#chunk cache (bytes per file, None: library default) can be changed with
+#
+#hdf5lib.SetPool(128, chunk_cache_bytes=64*1024**2)
+#
+#and hdf5lib.CloseAll() closes all pooled files (a size of 0 disables pooling).
+#
+#writing (CreateGroup, SetAttr, CreateArray with chunking/compression/shuffle, AppendArray) works with both interfaces.
+#
+#the cache files of all readers (indices, offsets, field and lookup tables) are checked with FileSignature,
+#named with CacheKey and written with WriteAtomic.
+#
 # Mark Vogelsberger (mvogelsb@cfa.harvard.edu)
 import sys
+import os
+import atexit
+import hashlib
+import collections
+import zlib
+import concurrent.futures
+import threading
+import numpy
 import hdf5lib_param
 
 try:
@@ -52,10 +78,147 @@ except:
 		use_tables=False
 
 
+pool_size = 64
+chunk_cache = None
+pool = collections.OrderedDict()
+retired = {}
+maps = {}
+pool_lock = threading.RLock()
+
+#open file of the pool with its stamp (FileSignature, None if it is missing) and the number of callers using it; a file
+#that leaves the pool while it is used is retired and closed by the last caller
+class PoolEntry:
+	def __init__(self, key, f, stamp):
+		self.key = key
+		self.f = f
+		self.stamp = stamp
+		self.refs = 0
+		self.retired = False
+
+	def release(self):
+		self.refs -= 1
+		if (self.retired) & (self.refs == 0):
+			self.f.close()
+			retired[self.key].remove(self)
+			if (len(retired[self.key]) == 0):
+				del retired[self.key]
+
+#pooled read-only handle: behaves like the file, but close() only gives it back to the pool
+class PooledFile:
+	entry = None
+
+	def __init__(self, entry):
+		entry.refs += 1
+		self.entry = entry
+		self.f = entry.f
+
+	def __getattr__(self, name):
+		return getattr(self.f, name)
+
+	def __getitem__(self, key):
+		return self.f[key]
+
+	def __contains__(self, key):
+		return key in self.f
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def close(self):
+		with pool_lock:
+			if (self.entry is not None):
+				self.entry.release()
+				self.entry = None
+				ShrinkPool()
+
+	def __del__(self):
+		self.close()
+
+#keep at most size read-only handles open, each with an HDF5 chunk cache of chunk_cache_bytes
+def SetPool(size, chunk_cache_bytes=None):
+	global pool_size, chunk_cache
+	with pool_lock:
+		pool_size = size
+		if (chunk_cache_bytes != chunk_cache):
+			chunk_cache = chunk_cache_bytes
+			CloseAll()
+		ShrinkPool()
+
+#take a file out of the pool; it is closed now or, if still in use, by its last caller
+def RemoveFile(key):
+	entry = pool.pop(key)
+	if (entry.refs == 0):
+		entry.f.close()
+	else:
+		entry.retired = True
+		retired.setdefault(key, []).append(entry)
+	for mkey in [mkey for mkey in maps if mkey[0] == key]:
+		del maps[mkey]
+
+#close the least recently used files that are not in use until at most pool_size are open
+def ShrinkPool():
+	for key in [key for key in pool if pool[key].refs == 0][:max(len(pool) - max(pool_size, 0), 0)]:
+		RemoveFile(key)
+
+def CloseFile(fname):
+	key = os.path.abspath(fname)
+	with pool_lock:
+		if (key in pool):
+			RemoveFile(key)
+
+def CloseAll():
+	with pool_lock:
+		for key in list(pool.keys()):
+			RemoveFile(key)
+		maps.clear()
+
+atexit.register(CloseAll)
+
+#whether a read handle of the file handed out by the pool has not been closed yet
+def InUse(fname):
+	key = os.path.abspath(fname)
+	with pool_lock:
+		return ((key in pool) and (pool[key].refs > 0)) or (key in retired)
+
 def OpenFile(fname, mode = "r"):
+	key = os.path.abspath(fname)
+	if (mode != "r"):
+		with pool_lock:
+			if InUse(key):
+				raise IOError("cannot open "+fname+" with mode "+mode+": a pooled read handle of it is still in use")
+			CloseFile(key)
+		return OpenFileDirect(fname, mode)
+	if (pool_size <= 0):
+		return OpenFileDirect(fname, mode)
+
+	try:
+		stamp = FileSignature([key])
+	except OSError:
+		stamp = None
+	with pool_lock:
+		if (key in pool):
+			if (pool[key].stamp == stamp):
+				pool.move_to_end(key)
+				return PooledFile(pool[key])
+			RemoveFile(key)
+
+		entry = PoolEntry(key, OpenFileDirect(fname, mode), stamp)
+		pool[key] = entry
+		handle = PooledFile(entry)
+		ShrinkPool()
+		return handle
+
+def OpenFileDirect(fname, mode = "r"):
 	if (use_tables):
+		if (chunk_cache is not None):
+			return tables.open_file(fname, mode = mode, CHUNK_CACHE_SIZE = chunk_cache)
 		return tables.open_file(fname, mode = mode)
 	else:
+		if (chunk_cache is not None):
+			return h5py.File(fname, mode, rdcc_nbytes = chunk_cache)
 		return h5py.File(fname, mode)
 
 def GetData(f, dname):
@@ -64,6 +227,119 @@ def GetData(f, dname):
 	else:
 		return f[dname]
 
+#read rows [start, stop) of a dataset directly into out (shape of the selection)
+def ReadData(f, dname, start, stop, out):
+	data = GetData(f, dname)
+	if (out.flags.c_contiguous==False):
+		out[...] = data[start:stop]
+	elif (use_tables):
+		if (out.dtype == data.dtype):
+			data.read(start, stop, out=out)
+		else:
+			out[...] = data.read(start, stop)
+	else:
+		data.read_direct(out, source_sel=numpy.s_[start:stop])
+	return out
+
+#as ReadData, but chunks compressed with gzip (optionally shuffled) are fetched raw and decompressed
+#on nthreads threads (zlib releases the GIL), then copied into out; needs h5py (read_direct_chunk) and
+#chunks spanning all but the first axis. Anything else, and chunks that cannot be fetched raw (e.g.
+#never written), is read through ReadData.
+def ReadDataThreaded(f, dname, start, stop, out, nthreads):
+	if (use_tables) | (nthreads <= 1) | (stop <= start):
+		return ReadData(f, dname, start, stop, out)
+	data = f[dname]
+	if (data.chunks is None) | (hasattr(data.id, "read_direct_chunk")==False) | (data.dtype.hasobject):
+		return ReadData(f, dname, start, stop, out)
+	plist = data.id.get_create_plist()
+	filters = [plist.get_filter(i)[0] for i in range(plist.get_nfilters())]
+	if (h5py.h5z.FILTER_DEFLATE not in filters) | (len(set(filters) - set([h5py.h5z.FILTER_DEFLATE, h5py.h5z.FILTER_SHUFFLE])) > 0) | (tuple(data.chunks[1:]) != tuple(data.shape[1:])):
+		return ReadData(f, dname, start, stop, out)
+
+	rows = data.chunks[0]
+	itemsize = data.dtype.itemsize
+	def decode(nchunk):
+		lo = max(start, nchunk*rows)
+		hi = min(stop, (nchunk+1)*rows)
+		try:
+			mask, raw = data.id.read_direct_chunk((nchunk*rows,) + (0,)*(len(data.shape)-1))
+		except (KeyError, ValueError, RuntimeError, OSError):
+			ReadData(f, dname, lo, hi, out[lo-start:hi-start])
+			return
+		#undo the filters in reverse pipeline order, skipping those disabled for this chunk
+		for i in reversed(range(len(filters))):
+			if (mask & (1 << i)):
+				continue
+			if (filters[i] == h5py.h5z.FILTER_DEFLATE):
+				raw = zlib.decompress(raw)
+			elif (itemsize > 1):
+				raw = numpy.frombuffer(raw, dtype=numpy.uint8).reshape(itemsize, -1).T.tobytes()
+		chunk = numpy.frombuffer(raw, dtype=data.dtype).reshape(data.chunks)
+		out[lo-start:hi-start] = chunk[lo-nchunk*rows:hi-nchunk*rows]
+
+	with concurrent.futures.ThreadPoolExecutor(max_workers=nthreads) as executor:
+		list(executor.map(decode, range(start//rows, (stop-1)//rows + 1)))
+	return out
+
+#rows (sorted, unique indices) of a dataset; dense selections are read as one slab and
+#picked in memory, sparse ones are read as a point selection
+def ReadRows(f, dname, rows):
+	datamap = GetDataMap(f, dname)
+	if (datamap is not None):
+		return numpy.asarray(datamap[rows])
+	data = GetData(f, dname)
+	if (len(rows) == 0):
+		return data[0:0]
+	start = int(rows[0])
+	stop = int(rows[-1]) + 1
+	if (stop - start <= 16*len(rows)):
+		return data[start:stop][rows - start]
+	if (use_tables):
+		return data[[int(row) for row in rows]]
+	return data[rows]
+
+#read-only np.memmap of a whole dataset that is stored contiguous and unfiltered in the file,
+#or None if it is chunked, filtered, external, empty or not yet allocated; the maps of pooled
+#files are kept until the file leaves the pool. The file offset of a dataset is only
+#available through h5py, so with PyTables this always returns None.
+def GetDataMap(f, dname):
+	if (use_tables):
+		return None
+	key = (os.path.abspath(f.filename), dname)
+	if (key in maps):
+		return maps[key]
+	data = f[dname]
+	plist = data.id.get_create_plist()
+	offset = data.id.get_offset()
+	if (data.chunks is not None) | (plist.get_nfilters() > 0) | (plist.get_external_count() > 0) | (offset is None) | (data.size == 0) | (data.dtype.hasobject):
+		datamap = None
+	else:
+		datamap = numpy.memmap(f.filename, mode="r", dtype=data.dtype, offset=offset, shape=data.shape)
+	with pool_lock:
+		if (key[0] in pool):
+			maps[key] = datamap
+	return datamap
+
+#names of the members of a group ("" for the root group)
+def ListGroup(f, gname):
+	if (use_tables):
+		group = f.root if (gname=="") else f.root._f_get_child(gname)
+		return list(group._v_children.keys())
+	else:
+		group = f if (gname=="") else f[gname]
+		return list(group.keys())
+
+#storage of a dataset: dtype, shape, chunk shape (None: contiguous), compression filter (None, "gzip", "lzf", ...) and shuffle
+def GetDataInfo(f, dname):
+	data = GetData(f, dname)
+	if (use_tables):
+		compression = None
+		if (data.filters.complevel > 0):
+			compression = "gzip" if (data.filters.complib == "zlib") else data.filters.complib
+		return {"dtype": data.dtype.str, "shape": [int(n) for n in data.shape], "chunks": None if (data.chunkshape is None) else [int(n) for n in data.chunkshape], "compression": compression, "shuffle": bool(data.filters.shuffle)}
+	else:
+		return {"dtype": data.dtype.str, "shape": [int(n) for n in data.shape], "chunks": None if (data.chunks is None) else [int(n) for n in data.chunks], "compression": data.compression, "shuffle": bool(data.shuffle)}
+
 def GetGroup(f, gname):
 	if (use_tables):
 		return f.root._f_get_child(gname) 
@@ -94,25 +370,93 @@ def ContainsGroup(group, cname):
 	return group.__contains__(cname)
 
 		
-def CreateArray(f, where, aname, aval):
+#storage options: chunks (chunk shape, True: automatic), compression ("gzip" or, with h5py only, "lzf"),
+#compression_opts (gzip level) and shuffle; with extendable the array can later grow along its first
+#axis with AppendArray. Without any of them a plain contiguous array is written.
+def CreateArray(f, where, aname, aval, chunks=None, compression=None, compression_opts=None, shuffle=False, extendable=False):
+	aval = numpy.asarray(aval)
+	plain = (chunks is None) & (compression is None) & (shuffle==False) & (extendable==False)
 	if (use_tables):
-		f.create_array(where, aname, aval)
+		if (plain):
+			f.create_array(where, aname, aval)
+			return
+		if (compression not in [None, "gzip"]):
+			print("compression not supported by PyTables:", compression)
+			sys.exit()
+		complevel = 0
+		if (compression == "gzip"):
+			complevel = 4 if (compression_opts is None) else compression_opts
+		filters = tables.Filters(complevel=complevel, complib="zlib", shuffle=shuffle)
+		chunkshape = None if (chunks is None) | (chunks is True) else chunks
+		if (extendable):
+			node = f.create_earray(where, aname, atom=tables.Atom.from_dtype(aval.dtype), shape=(0,)+aval.shape[1:], filters=filters, chunkshape=chunkshape, expectedrows=max(len(aval), 1))
+			node.append(aval)
+		else:
+			f.create_carray(where, aname, obj=aval, filters=filters, chunkshape=chunkshape)
 	else:
-		print("NOT IMPLEMENTED!")
-		sys.exit()
+		if (plain):
+			where.create_dataset(aname, data=aval)
+			return
+		maxshape = ((None,)+aval.shape[1:]) if (extendable) else None
+		#chunks of about 1 MB, h5py would size them for the first rows only
+		if (chunks is None) & (extendable):
+			rowbytes = aval.dtype.itemsize * int(numpy.prod(aval.shape[1:]))
+			chunks = (max(1, 2**20 // max(rowbytes, 1)),) + aval.shape[1:]
+		where.create_dataset(aname, data=aval, chunks=chunks, compression=compression, compression_opts=compression_opts, shuffle=shuffle, maxshape=maxshape)
+
+#append rows along the first axis of an array created with extendable=True
+def AppendArray(f, where, aname, aval):
+	aval = numpy.asarray(aval)
+	if (use_tables):
+		where._f_get_child(aname).append(aval)
+	else:
+		data = where[aname]
+		n = data.shape[0]
+		data.resize(n + aval.shape[0], axis=0)
+		data[n:] = aval
 
 
 def CreateGroup(f, gname):
 	if (use_tables):
 		return f.create_group(f.root, gname)
 	else:
-		print("NOT IMPLEMENTED!")
-		sys.exit()
+		return f.create_group(gname)
 
 
 def SetAttr(where, aname, aval):
 	if (use_tables):
 		setattr(where._v_attrs, aname, aval)
 	else:
-		print("NOT IMPLEMENTED!")
-		sys.exit()
+		where.attrs[aname] = aval
+
+
+######################
+#CACHE FILE UTILITIES#
+######################
+#sizes and modification times of files, [[size, mtime_ns], ...]; a cache made from files is used
+#while they still have the signature stored with it (raises OSError if a file is missing)
+def FileSignature(fnames):
+	signature = []
+	for fname in fnames:
+		st = os.stat(fname)
+		signature.append([int(st.st_size), int(st.st_mtime_ns)])
+	return signature
+
+#short hex key of a path and options, for cache file names
+def CacheKey(*parts):
+	return hashlib.sha1("/".join([str(part) for part in parts]).encode()).hexdigest()[:16]
+
+#write fname through write(f) on a private file that then replaces it, so readers (other ranks)
+#never see a partial file; creates missing directories, raises OSError on failure
+def WriteAtomic(fname, write, mode = "wb"):
+	dirname = os.path.dirname(fname)
+	if (dirname != "") and (os.path.exists(dirname) == False):
+		os.makedirs(dirname, exist_ok=True)
+	tmpname = fname+"."+str(os.getpid())+".tmp"
+	try:
+		with open(tmpname, mode) as f:
+			write(f)
+		os.replace(tmpname, fname)
+	finally:
+		if os.path.exists(tmpname):
+			os.remove(tmpname)
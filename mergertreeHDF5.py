@@ -3,11 +3,36 @@
 #
 # see example_X.py for usage
 #
+# trees are read lazily: tree.trees[ntree][field] reads that field of that tree on first use,
+# and only the cache_size most recently used trees are kept in memory. tree.get_flat(field)
+# returns one field of all trees concatenated, with tree ntree at rows
+# tree.TreeOffsets[ntree]:tree.TreeOffsets[ntree+1].
+#
+# main progenitor branches of many halos at once, as flat rows per snapshot, and their masses:
+#
+# rows = tree.getMainBranches(ntrees, nhalos)
+# mstar = tree.getBranchValues(rows, "SubhaloMassType")[:,:,4]
+#
+# subhalo lookup tables are built over all tree files at once (and stored in the user cache
+# directory, ~/.cache/mergertreeHDF5, unless a base is given) and memory mapped when loaded:
+#
+# tree.buildSubhaloLookup(snapnum)
+# filenum, ntree, nhalo = tree.lookupSubhalo(subhalo_nums)
+#
+# SubLink trees: one contiguous slice per subhalo history, located through the offsets files:
+#
+# sublink = sublink_tree(treedir, offsetdir)
+# branch = sublink.getMainBranch(snapnum, subfind_id, ["SnapNum", "SubhaloMassType"])
+#
+# merger counts of a sample above stellar mass ratios and after snapshots, as one columnar .npz file:
+#
+# python mergertreeHDF5.py summary BASEDIR SKIPFAC SNAPNUM IDFILE OUTFILE --ratios 0.25 0.1 0.01 --snaps 128 97
 #
 # Mark Vogelsberger (mvogelsb@cfa.harvard.edu)
 
 import numpy as np
 import os
+import collections
 import sys
 import hdf5lib
 import pdb
@@ -37,23 +62,99 @@ mergertree_datablocks = {"Descendant":                 ["int32",   1, True],
                          "SubhaloStarMetallicity":     ["float32", 1, True],
                          "SubhaloOffsetType":          ["int64",   6, True],
                          "SubhaloLenType":             ["int32",   6, True],
-	                 "SubhaloMassType":            ["float32", 6, True],
+                         "SubhaloMassType":            ["float32", 6, True],
                          "SubhaloMassInRadType":       ["float32", 6, True],
-		         "SubhaloHalfmassRadType":     ["float32", 6, True],
+                         "SubhaloHalfmassRadType":     ["float32", 6, True],
                          "SubhaloBHMass":              ["float32", 1, True],
                          "SubhaloBHMdot":              ["float32", 1, True], 
                          "SubhaloSFRinRad":            ["float32", 1, True],
                          "SubhaloStellarPhotometrics": ["float32", 8, True]}
 
 
+default_cache_size = 256
+default_cachedir = os.path.join(os.path.expanduser("~"), ".cache", "mergertreeHDF5")
+
+############
+#LAZY TREES#
+############
+#fields of one tree, each read from the file the first time it is used
+class lazy_tree(dict):
+	def __init__(self, trees, ntree):
+		dict.__init__(self)
+		self.owner = trees
+		self.ntree = ntree
+		self.fields = None
+
+	def field_names(self):
+		if (self.fields == None):
+			f = hdf5lib.OpenFile(self.owner.filename)
+			gname = "Tree"+str(self.ntree)
+			names = self.owner.keysel if (self.owner.keysel != None) else list(mergertree_datablocks.keys())
+			self.fields = [name for name in names if hdf5lib.Contains(f, gname, name)]
+			f.close()
+		return self.fields
+
+	def keys(self):
+		return self.field_names()
+
+	def __contains__(self, key):
+		return key in self.field_names()
+
+	def __missing__(self, key):
+		if (self.owner.keysel != None) and (key not in self.owner.keysel):
+			raise KeyError(key)
+		f = hdf5lib.OpenFile(self.owner.filename)
+		data = hdf5lib.GetData(f, "Tree"+str(self.ntree)+"/"+key)[:]
+		f.close()
+		self[key] = data
+		return data
+
+#trees [tree_start, tree_start+tree_num) of one file, indexed from 0 like the former object array;
+#at most cache_size trees are kept, the least recently used ones are dropped first
+class tree_cache:
+	def __init__(self, filename, tree_start, tree_num, keysel=None, cache_size=default_cache_size):
+		self.filename = filename
+		self.tree_start = tree_start
+		self.tree_num = tree_num
+		self.keysel = keysel
+		self.cache_size = cache_size
+		self.trees = collections.OrderedDict()
+
+	def __len__(self):
+		return self.tree_num
+
+	def __iter__(self):
+		for ntree in range(0, self.tree_num):
+			yield self[ntree]
+
+	def __getitem__(self, ntree):
+		if (ntree < 0):
+			ntree += self.tree_num
+		if (ntree < 0) | (ntree >= self.tree_num):
+			raise IndexError("tree "+str(ntree)+" out of range")
+		if (ntree in self.trees):
+			self.trees.move_to_end(ntree)
+			return self.trees[ntree]
+		tree = lazy_tree(self, self.tree_start + ntree)
+		self.trees[ntree] = tree
+		while (len(self.trees) > max(self.cache_size, 1)):
+			self.trees.popitem(last=False)
+		return tree
+
+	def clear(self):
+		self.trees.clear()
+
+
 class merger_tree:
-        def __init__(self, basedir, skipfac, snapnum, filenum = 0, tree_start = -1, tree_num = -1, keysel = None):
+	def __init__(self, basedir, skipfac, snapnum, filenum = 0, tree_start = -1, tree_num = -1, keysel = None, cache_size = default_cache_size):
 
 		self.filebase = basedir + "trees_sf"+str(skipfac)+"_"+str(snapnum).zfill(3)
 		self.basedir = basedir
 		self.filenum = filenum
-		filename = self.filebase + "." + str(filenum) + ".hdf5"
-		f=hdf5lib.OpenFile(filename)
+		self.skipfac = skipfac
+		self.snapnum = snapnum
+		self.filename = self.filebase + "." + str(filenum) + ".hdf5"
+		f=hdf5lib.OpenFile(self.filename)
 		self.NtreesPerFile = hdf5lib.GetAttr(f, "Header", "NtreesPerFile") 
 		self.NumberOfOutputFiles = hdf5lib.GetAttr(f, "Header", "NumberOfOutputFiles") 
 		self.ParticleMass = hdf5lib.GetAttr(f, "Header", "ParticleMass") 
@@ -62,52 +163,175 @@ class merger_tree:
 		self.TreeNHalos = hdf5lib.GetData(f, "Header/TreeNHalos")[:] 
 		self.TotNsubhalos = hdf5lib.GetData(f, "Header/TotNsubhalos")[:] 
 		self.Redshifts = hdf5lib.GetData(f, "Header/Redshifts")[:] 
+		f.close()
 		if (tree_start == -1 ) | (tree_num == -1):
 			tree_start = 0
 			tree_num = self.NtreesPerFile
-		self.trees = np.empty(tree_num - tree_start, dtype='object')
 		self.tree_start = tree_start
 		self.tree_num = tree_num
-		for ntree in range(tree_start, tree_start + tree_num):
-			list = []
-			if (keysel==None):
-				for datablock in list(mergertree_datablocks.keys()):
-					data = hdf5lib.GetData(f, "Tree"+str(ntree)+"/"+datablock)[:] 
-					list.append((datablock,data))
-			else:
-				for datablock in keysel:
-					if hdf5lib.Contains(f, "Tree"+str(ntree), datablock):
-						data = hdf5lib.GetData(f, "Tree"+str(ntree)+"/"+datablock)[:]
-						list.append((datablock,data))
-			self.trees[ntree - tree_start] = dict(list)
+		self.keysel = keysel
+
+		#trees are read on first access, field by field
+		self.trees = tree_cache(self.filename, tree_start, tree_num, keysel, cache_size)
+
+		#flat layout: halo nhalo of tree ntree is row TreeOffsets[ntree]+nhalo of get_flat(field)
+		self.TreeOffsets = np.zeros(tree_num + 1, dtype="int64")
+		np.cumsum(self.TreeNHalos[tree_start:tree_start + tree_num], out=self.TreeOffsets[1:])
+		self.flat = {}
+		self.flat_pointers = {}
+
+	#one field of all trees concatenated in tree order (tree-local pointers are not shifted)
+	def get_flat(self, key):
+		if (key in self.flat):
+			return self.flat[key]
+		if (self.keysel != None) and (key not in self.keysel):
+			raise KeyError(key)
+		f = hdf5lib.OpenFile(self.filename)
+		data = None
+		for ntree in range(0, self.tree_num):
+			start = self.TreeOffsets[ntree]
+			stop = self.TreeOffsets[ntree + 1]
+			dname = "Tree"+str(self.tree_start + ntree)+"/"+key
+			if (data is None):
+				dset = hdf5lib.GetData(f, dname)
+				data = np.empty((self.TreeOffsets[-1],) + tuple(dset.shape[1:]), dtype=dset.dtype)
+			if (stop > start):
+				hdf5lib.ReadData(f, dname, 0, stop - start, data[start:stop])
 		f.close()
+		if (data is None):
+			datatype, dim, _ = mergertree_datablocks[key]
+			data = np.empty((0,) if dim == 1 else (0, dim), dtype=datatype)
+		self.flat[key] = data
+		return data
+
+	#tree (relative to tree_start) and halo of rows of the flat layout
+	def flat_to_tree(self, index):
+		ntree = np.searchsorted(self.TreeOffsets, index, side="right") - 1
+		return ntree, index - self.TreeOffsets[ntree]
+
+	#pointer field (Descendant, FirstProgenitor, ...) of the flat layout, shifted to flat rows (-1 stays -1)
+	def get_flat_pointer(self, key):
+		if (key in self.flat_pointers):
+			return self.flat_pointers[key]
+		data = self.get_flat(key).astype("int64")
+		ntree = np.repeat(np.arange(0, self.tree_num), np.diff(self.TreeOffsets))
+		valid = data >= 0
+		data[valid] += self.TreeOffsets[ntree[valid]]
+		self.flat_pointers[key] = data
+		return data
+
+	#follow the pointer field key from the flat rows start for all of them at once; row i of the
+	#result holds the flat row of the branch at each snapshot (-1 where the branch has no halo)
+	def __follow_branches(self, start, key):
+		start = np.atleast_1d(np.asarray(start, dtype="int64"))
+		pointer = self.get_flat_pointer(key)
+		snaps = self.get_flat("SnapNum")
+		rows = np.zeros([len(start), len(self.Redshifts)], dtype="int64") - 1
+		branch = np.arange(0, len(start))
+		cur = start
+		active = cur >= 0
+		branch = branch[active]
+		cur = cur[active]
+		while (len(cur) > 0):
+			rows[branch, snaps[cur]] = cur
+			cur = pointer[cur]
+			active = cur >= 0
+			branch = branch[active]
+			cur = cur[active]
+		return rows
+
+	#main progenitor branches (nhalo and its first progenitors) of many halos, see __follow_branches
+	def getMainBranches(self, ntrees, nhalos):
+		start = self.TreeOffsets[np.asarray(ntrees)] + np.asarray(nhalos)
+		return self.__follow_branches(start, "FirstProgenitor")
 
-        def __count_unique(self, keys):
-                uniq_keys = np.unique(keys)
-                bins = uniq_keys.searchsorted(keys)
-                return uniq_keys, np.bincount(bins)
+	#descendant branches (nhalo and its descendants) of many halos, see __follow_branches
+	def getDescendantBranches(self, ntrees, nhalos):
+		start = self.TreeOffsets[np.asarray(ntrees)] + np.asarray(nhalos)
+		return self.__follow_branches(start, "Descendant")
 
+	#mergers onto the main progenitor branches of many halos: for every halo that descends into a
+	#main branch halo without being its first progenitor, returns the index of the branch (position in
+	#ntrees/nhalos), the snapshot of the descendant and the stellar mass ratio (<= 1) of the two
+	#progenitors. ratio_at="max" compares the masses when the secondary had its largest stellar mass
+	#(along its own main branch), ratio_at="merger" the masses at the snapshot before the merger.
+	def getMergerList(self, ntrees, nhalos, ratio_at = "max"):
+		rows = self.getMainBranches(ntrees, nhalos)
+		descs = self.get_flat_pointer("Descendant")
+		firsts = self.get_flat_pointer("FirstProgenitor")
+		mstar = self.get_flat("SubhaloMassType")[:,4]
+
+		#secondary progenitors of the file and the main branch halos they descend into
+		secs = np.where(descs >= 0)[0]
+		secs = secs[firsts[descs[secs]] != secs]
+		branch, snap = np.nonzero(rows >= 0)
+		order = np.argsort(rows[branch, snap], kind="stable")
+		branch_rows = rows[branch, snap][order]
+		lo = np.searchsorted(branch_rows, descs[secs], side="left")
+		counts = np.searchsorted(branch_rows, descs[secs], side="right") - lo
+		sec = np.repeat(np.arange(0, len(secs)), counts)
+		pos = lo[sec] + np.arange(0, len(sec)) - np.repeat(np.cumsum(counts) - counts, counts)
+		merger_branch = branch[order[pos]]
+		secs = secs[sec]
+		primary = firsts[descs[secs]]
+		snap_merging = self.get_flat("SnapNum")[descs[secs]]
+
+		if (ratio_at == "max"):
+			sec_rows = self.__follow_branches(secs, "FirstProgenitor")
+			sec_mass = np.where(sec_rows >= 0, mstar[sec_rows], -1)
+			tmax = np.argmax(sec_mass, axis=1)
+			m_sec = sec_mass[np.arange(0, len(secs)), tmax]
+			prim_rows = rows[merger_branch, tmax]
+			m_prim = np.where(prim_rows >= 0, mstar[prim_rows], 0)
+		elif (ratio_at == "merger"):
+			m_sec = mstar[secs]
+			m_prim = mstar[primary]
+		else:
+			print("unknown ratio_at :", ratio_at)
+			sys.exit()
+
+		m_max = np.maximum(m_sec, m_prim)
+		ratio = np.zeros(len(secs))
+		np.divide(np.minimum(m_sec, m_prim), m_max, out=ratio, where=m_max > 0)
+		return merger_branch, snap_merging, ratio
+
+	#values of a field along branches returned by getMainBranches/getDescendantBranches, fill where empty
+	def getBranchValues(self, rows, key, fill = 0):
+		data = self.get_flat(key)
+		values = np.zeros(rows.shape + data.shape[1:], dtype=data.dtype) + fill
+		valid = rows >= 0
+		values[valid] = data[rows[valid]]
+		return values
+
+	#histogram of (log10 progenitor mass, progenitor/descendant length ratio) of all progenitors at snapnum
+	#of descendants with more than one progenitor there; snapnum may also be a list of snapshots, then
+	#htot has one histogram per snapshot (first axis). Computed on the flat layout in one pass.
 	def getNumberOfMergers(self, snapnum, bins_halo = 10, bins_ratio = 10, halo_min = 8, halo_max = 13, ratio_min = 0, ratio_max = 1):
-		htot = np.zeros([bins_halo, bins_ratio])
-		xtot = 0
-		ytot = 0
-		for ntree in range(0,self.tree_num):
-			idx = (self.trees[ntree]["SnapNum"][:] == snapnum) & (self.trees[ntree]["Descendant"] >= 0)
-			if (idx.any()):
-				halos = np.arange(0, self.TreeNHalos[ntree])[idx]
-				descs = self.trees[ntree]["Descendant"][idx]
-				d_tmp, n_tmp = self.__count_unique(descs)
-				merger_descs = d_tmp[n_tmp > 1]   #indices of halos where more than 1 object 'descends-into' 
-				if (len(descs) > 0):
-					for md in merger_descs:
-						len_desc = self.trees[ntree]["SubhaloLenType"][:,1][md]   #len of the central descendant, snp=snapnum+1
-						len_halos = self.trees[ntree]["SubhaloLenType"][:,1][md == descs] #len of the objects that descend into the one above, snp=snapnum 
-						ratio = 1.0 * len_halos / len_desc		
-						x = np.log10(len_halos * self.ParticleMass * 1e10)
-						y = ratio
-						h, xtot, ytot = np.histogram2d(x, y, bins=(bins_halo, bins_ratio), range = [[halo_min,halo_max], [ratio_min, ratio_max]])
-						htot += h
-		return [xtot, ytot, htot]
+		snapnums = np.atleast_1d(snapnum)
+		snaps = self.get_flat("SnapNum")
+		descs = self.get_flat_pointer("Descendant")
+
+		#progenitors at one of the snapshots, keyed by (descendant, snapshot)
+		snapidx = np.zeros(len(snaps), dtype="int64") - 1
+		for i in range(0, len(snapnums)):
+			snapidx[snaps == snapnums[i]] = i
+		halos = np.where((snapidx >= 0) & (descs >= 0))[0]
+		keys = descs[halos] * len(snapnums) + snapidx[halos]
+		_, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+		halos = halos[counts[inverse] > 1]   #progenitors of halos where more than 1 object 'descends-into'
+
+		lentype = self.get_flat("SubhaloLenType")
+		len_desc = lentype[descs[halos],1]   #len of the descendant, snp=snapnum+1
+		len_halos = lentype[halos,1]   #len of the objects that descend into the one above, snp=snapnum
+		ratio = 1.0 * len_halos / len_desc
+		x = np.log10(len_halos * self.ParticleMass * 1e10)
+		y = ratio
+		h, edges = np.histogramdd((snapidx[halos], x, y), bins=(len(snapnums), bins_halo, bins_ratio), range = [[-0.5, len(snapnums) - 0.5], [halo_min,halo_max], [ratio_min, ratio_max]])
+		xtot = edges[1]
+		ytot = edges[2]
+		if (np.ndim(snapnum) == 0):
+			return [xtot, ytot, h[0]]
+		return [xtot, ytot, h]
 
 	def getNumberOfMergersMainBranch(self, snapnum, id_descendant, ntree, bins_halo = 10, bins_ratio = 10, halo_min = 8, halo_max = 13, ratio_min = 0, ratio_max = 1):
 		htot = np.zeros([bins_halo, bins_ratio])
@@ -186,21 +410,21 @@ class merger_tree:
 			next = self.trees[ntree]["NextProgenitor"][next]
 		return list
 
-        def getFirstProgenitors(self, ntree, nhalo):
-                list = []
-                next = nhalo 
-                while (next >= 0):
-                        list.append(next)
-                        next = self.trees[ntree]["FirstProgenitor"][next]
-                return list
-
-        def getHalosInFOFGroup(self, ntree, nhalo):
-                list = []
-                next = self.trees[ntree]["FirstHaloInFOFGroup"][nhalo]
-                while (next >= 0):
-                        list.append(next)
-                        next =self.trees[ntree]["NextHaloInFOFGroup"][next]
-                return list
+	def getFirstProgenitors(self, ntree, nhalo):
+		list = []
+		next = nhalo 
+		while (next >= 0):
+			list.append(next)
+			next = self.trees[ntree]["FirstProgenitor"][next]
+		return list
+
+	def getHalosInFOFGroup(self, ntree, nhalo):
+		list = []
+		next = self.trees[ntree]["FirstHaloInFOFGroup"][nhalo]
+		while (next >= 0):
+			list.append(next)
+			next =self.trees[ntree]["NextHaloInFOFGroup"][next]
+		return list
 
 	def getDescendants(self, ntree, nhalo):
 		list = []
@@ -210,43 +434,218 @@ class merger_tree:
 			next = self.trees[ntree]["Descendant"][next]
 		return list
 
+	#(filenum, tree, halo) of every subhalo of snapnum found in this file's trees, -1 for the others
+	def __subhalo_lookup(self, snapnum):
+		table = np.zeros([self.TotNsubhalos[snapnum],3], dtype='int32') - 1
+		rows = np.where(self.get_flat("SnapNum") == snapnum)[0]
+		subnums = self.get_flat("SubhaloNumber")[rows]
+		ntree, nhalo = self.flat_to_tree(rows)
+		table[subnums,0] = self.filenum
+		table[subnums,1] = self.tree_start + ntree
+		table[subnums,2] = nhalo
+		return table
+
 	def constructSubhaloLookup(self, snapnum):
-		self.SubhaloLookupTable = np.zeros([self.TotNsubhalos[snapnum],3], dtype='int32') - 1
-		for ntree in range(0,self.tree_num):
-			idx = (self.trees[ntree]["SnapNum"][:] == snapnum) 
-			halos = np.arange(0, self.TreeNHalos[ntree], dtype='int32')[idx]
-			subnums = self.trees[ntree]["SubhaloNumber"][idx]
-			self.SubhaloLookupTable[subnums,0] = self.filenum
-			self.SubhaloLookupTable[subnums,1] = ntree
-			self.SubhaloLookupTable[subnums,2] = halos
-		f=open(self.basedir+"/SubhaloLookup_"+str(snapnum).zfill(3)+"."+str(self.filenum)+".dat","wb")
-		self.SubhaloLookupTable.astype("int32").tofile(f)
-		f.close()
-	
+		self.SubhaloLookupTable = self.__subhalo_lookup(snapnum)
+		write_lookup(self.basedir+"/SubhaloLookup_"+str(snapnum).zfill(3)+"."+str(self.filenum)+".dat", self.SubhaloLookupTable)
+
 	def combineSubhaloLookup(self, snapnum):
 		self.SubhaloLookupTable = np.zeros([self.TotNsubhalos[snapnum],3], dtype='int32') - 1
 		for filenum in range(0, self.NumberOfOutputFiles):
-			f=open(self.basedir+"/SubhaloLookup_"+str(snapnum).zfill(3)+"."+str(filenum)+".dat","rb")			
-			tmp = np.fromfile(f, dtype="int32", count=3 * self.TotNsubhalos[snapnum]).reshape([self.TotNsubhalos[snapnum],3])
-			f.close()
-			idx = tmp != -1
+			tmp = read_lookup(self.basedir+"/SubhaloLookup_"+str(snapnum).zfill(3)+"."+str(filenum)+".dat", self.TotNsubhalos[snapnum])
+			idx = tmp[:,0] != -1
 			self.SubhaloLookupTable[idx] = tmp[idx]
-	
+
+	#lookup table of all tree files in one pass (replaces constructSubhaloLookup on every file followed
+	#by combineSubhaloLookup); it is written to base/SubhaloLookup_SSS.dat, base defaults to lookup_cachedir()
+	def buildSubhaloLookup(self, snapnum, base = None):
+		self.SubhaloLookupTable = np.zeros([self.TotNsubhalos[snapnum],3], dtype='int32') - 1
+		for filenum in range(0, self.NumberOfOutputFiles):
+			if (filenum == self.filenum) & (self.tree_start == 0) & (self.tree_num == self.NtreesPerFile):
+				tree = self
+			else:
+				tree = merger_tree(self.basedir, self.skipfac, self.snapnum, filenum = filenum, keysel = ["SnapNum", "SubhaloNumber"])
+			tmp = tree.__subhalo_lookup(snapnum)
+			idx = tmp[:,0] != -1
+			self.SubhaloLookupTable[idx] = tmp[idx]
+		self.saveSubhaloLookup(self.lookup_cachedir() if (base == None) else base, snapnum)
+
+	#directory of the lookup tables of these trees in the user cache, so that the tree directory is never written to
+	def lookup_cachedir(self):
+		return default_cachedir+"/"+hdf5lib.CacheKey(os.path.abspath(self.basedir), self.skipfac, self.snapnum)
+
 	def saveSubhaloLookup(self, base, snapnum):
-		f=open(base+"/SubhaloLookup_"+str(snapnum).zfill(3)+".dat","wb")
-		self.SubhaloLookupTable.astype("int32").tofile(f)
-		f.close()
+		write_lookup(base+"/SubhaloLookup_"+str(snapnum).zfill(3)+".dat", self.SubhaloLookupTable)
 
+	#the table is memory mapped, lookups only read the pages of the requested subhalos
 	def loadSubhaloLookup(self, base, snapnum):
-		f=open(base+"/SubhaloLookup_"+str(snapnum).zfill(3)+".dat","rb")
-		self.SubhaloLookupTable = np.fromfile(f, dtype="int32", count=3 * self.TotNsubhalos[snapnum]).reshape([self.TotNsubhalos[snapnum],3])
-		f.close()
-	
+		self.SubhaloLookupTable = read_lookup(base+"/SubhaloLookup_"+str(snapnum).zfill(3)+".dat", self.TotNsubhalos[snapnum])
+
 	def getSubhaloLookupTable(self):
 		return self.SubhaloLookupTable
-	
+
+	#subhalo_num may be a single number or an array of them
 	def lookupSubhalo(self, subhalo_num):
-		filenum = self.SubhaloLookupTable[subhalo_num,0]
-		ntree = self.SubhaloLookupTable[subhalo_num,1]
-		nhalo = self.SubhaloLookupTable[subhalo_num,2]
-		return [filenum, ntree, nhalo]
+		if (np.ndim(subhalo_num) == 0):
+			filenum = self.SubhaloLookupTable[subhalo_num,0]
+			ntree = self.SubhaloLookupTable[subhalo_num,1]
+			nhalo = self.SubhaloLookupTable[subhalo_num,2]
+			return [filenum, ntree, nhalo]
+		entries = np.asarray(self.SubhaloLookupTable[subhalo_num])
+		return [entries[:,0], entries[:,1], entries[:,2]]
+
+
+###############
+#LOOKUP TABLES#
+###############
+#raw int32 (nsubhalos, 3) tables; written to a private file first, so readers never map a partial table
+def write_lookup(fname, table):
+	hdf5lib.WriteAtomic(fname, table.astype("int32").tofile)
+
+def read_lookup(fname, nsubhalos):
+	if (nsubhalos == 0):
+		return np.zeros([0,3], dtype="int32")
+	return np.memmap(fname, dtype="int32", mode="r", shape=(nsubhalos,3))
+
+
+###############
+#SUBLINK TREES#
+###############
+#SubLink trees (treedir/name.N.hdf5) store every subtree depth first and contiguously: the subtree
+#of the subhalo in row r spans rows r .. r + LastProgenitorID - SubhaloID, and its main progenitor
+#branch rows r .. r + MainLeafProgenitorID - SubhaloID. The row of a subhalo of a snapshot is taken
+#from offsetdir/offsets_SSS.hdf5 (Subhalo/SubLink/RowNum, rows count over all tree files), so a
+#history query reads one slice of one tree file.
+class sublink_tree:
+	def __init__(self, treedir, offsetdir, name = "tree_extended"):
+		self.treedir = treedir
+		self.offsetdir = offsetdir
+		self.filenames = []
+		while os.path.exists(treedir+"/"+name+"."+str(len(self.filenames))+".hdf5"):
+			self.filenames.append(treedir+"/"+name+"."+str(len(self.filenames))+".hdf5")
+		if (len(self.filenames) == 0):
+			print("file not found:", treedir+"/"+name+".0.hdf5")
+			sys.exit()
+
+		#first global row of every tree file
+		self.FileOffsets = np.zeros(len(self.filenames) + 1, dtype="int64")
+		for filenum in range(0, len(self.filenames)):
+			f = hdf5lib.OpenFile(self.filenames[filenum])
+			self.FileOffsets[filenum + 1] = self.FileOffsets[filenum] + hdf5lib.GetData(f, "SubhaloID").shape[0]
+			f.close()
+
+	#global rows (-1 if not in the trees) and subtree lengths of subhalos subfind_ids of snapnum
+	def getRows(self, snapnum, subfind_ids):
+		subfind_ids = np.atleast_1d(np.asarray(subfind_ids, dtype="int64"))
+		order = np.argsort(subfind_ids)
+		unique_ids, inverse = np.unique(subfind_ids[order], return_inverse=True)
+		f = hdf5lib.OpenFile(self.offsetdir+"/offsets_"+str(snapnum).zfill(3)+".hdf5")
+		rownum = np.empty(len(subfind_ids), dtype="int64")
+		lastprog = np.empty(len(subfind_ids), dtype="int64")
+		subid = np.empty(len(subfind_ids), dtype="int64")
+		rownum[order] = hdf5lib.ReadRows(f, "Subhalo/SubLink/RowNum", unique_ids)[inverse]
+		lastprog[order] = hdf5lib.ReadRows(f, "Subhalo/SubLink/LastProgenitorID", unique_ids)[inverse]
+		subid[order] = hdf5lib.ReadRows(f, "Subhalo/SubLink/SubhaloID", unique_ids)[inverse]
+		f.close()
+		return rownum, np.where(rownum >= 0, lastprog - subid + 1, 0)
+
+	#tree file and row within it of global rows
+	def row_to_file(self, rows):
+		filenum = np.searchsorted(self.FileOffsets, rows, side="right") - 1
+		return filenum, rows - self.FileOffsets[filenum]
+
+	#fields of rows [start, start+length) of one tree file, each read as a single slice
+	def read_slice(self, filenum, start, length, fields):
+		f = hdf5lib.OpenFile(self.filenames[filenum])
+		result = {}
+		for field in fields:
+			data = hdf5lib.GetData(f, field)
+			result[field] = np.empty((length,) + tuple(data.shape[1:]), dtype=data.dtype)
+			hdf5lib.ReadData(f, field, start, start + length, result[field])
+		f.close()
+		return result
+
+	#fields of the subtree (main_branch=False) or main progenitor branch (main_branch=True) of
+	#subhalo subfind_id of snapnum, as a dict of arrays; None if the subhalo is not in the trees
+	def getSubtree(self, snapnum, subfind_id, fields, main_branch = False):
+		rownum, length = self.getRows(snapnum, subfind_id)
+		if (rownum[0] < 0):
+			return None
+		filenum, start = self.row_to_file(rownum[0])
+		if (main_branch):
+			ids = self.read_slice(filenum, start, 1, ["SubhaloID", "MainLeafProgenitorID"])
+			length = ids["MainLeafProgenitorID"][0] - ids["SubhaloID"][0] + 1
+		else:
+			length = length[0]
+		return self.read_slice(filenum, start, length, fields)
+
+	def getMainBranch(self, snapnum, subfind_id, fields):
+		return self.getSubtree(snapnum, subfind_id, fields, main_branch = True)
+
+
+################
+#MERGER SUMMARY#
+################
+def summary_column(ratio, snap):
+	return "Mergers_ratio{:g}_snap{:d}".format(ratio, snap)
+
+#number of mergers with stellar mass ratio > each of ratios after each of snap_cutoffs (as in
+#StarsMassratio > r & SnapshotMerging > s of the merger lists) for the subhalos subhalo_nums of
+#snapnum, computed for the whole sample from the trees. Returns a dict of columns (SubhaloNumber,
+#InTrees and one summary_column(ratio, snap) per pair); with outfile they are also written as .npz.
+#Subhalos that are not in the trees get 0 mergers. The subhalo lookup of snapnum is read from
+#lookup_base and built there first if it does not exist; by default one already in basedir is
+#used, else the one in the user cache (tree.lookup_cachedir()), so basedir is never written to.
+def merger_summary(basedir, skipfac, snapnum, subhalo_nums, ratios = (0.25, 0.1, 0.01), snap_cutoffs = (128, 97), ratio_at = "max", lookup_base = None, outfile = None, cache_size = default_cache_size):
+	keysel = ["SnapNum", "SubhaloNumber", "Descendant", "FirstProgenitor", "SubhaloMassType"]
+	subhalo_nums = np.atleast_1d(np.asarray(subhalo_nums, dtype="int64"))
+
+	tree = merger_tree(basedir, skipfac, snapnum, keysel = keysel, cache_size = cache_size)
+	if (lookup_base == None):
+		lookup_base = basedir if os.path.exists(basedir+"/SubhaloLookup_"+str(snapnum).zfill(3)+".dat") else tree.lookup_cachedir()
+	if os.path.exists(lookup_base+"/SubhaloLookup_"+str(snapnum).zfill(3)+".dat"):
+		tree.loadSubhaloLookup(lookup_base, snapnum)
+	else:
+		tree.buildSubhaloLookup(snapnum, lookup_base)
+	filenums, ntrees, nhalos = tree.lookupSubhalo(subhalo_nums)
+
+	counts = np.zeros([len(subhalo_nums), len(ratios), len(snap_cutoffs)], dtype="int32")
+	for filenum in np.unique(filenums[filenums >= 0]):
+		if (filenum != tree.filenum):
+			tree = merger_tree(basedir, skipfac, snapnum, filenum = filenum, keysel = keysel, cache_size = cache_size)
+		sample = np.where(filenums == filenum)[0]
+		branch, snap_merging, ratio = tree.getMergerList(ntrees[sample], nhalos[sample], ratio_at)
+		for i in range(0, len(ratios)):
+			for j in range(0, len(snap_cutoffs)):
+				hit = (ratio > ratios[i]) & (snap_merging > snap_cutoffs[j])
+				counts[sample,i,j] = np.bincount(branch[hit], minlength=len(sample))
+
+	columns = {"SubhaloNumber": subhalo_nums, "InTrees": filenums >= 0}
+	for i in range(0, len(ratios)):
+		for j in range(0, len(snap_cutoffs)):
+			columns[summary_column(ratios[i], snap_cutoffs[j])] = counts[:,i,j]
+
+	if (outfile != None):
+		hdf5lib.WriteAtomic(outfile, lambda f: np.savez(f, **columns))
+	return columns
+
+
+if __name__ == "__main__":
+	import argparse
+	parser = argparse.ArgumentParser(description="merger tree tools")
+	subparsers = parser.add_subparsers(dest="command", required=True)
+	parser_summary = subparsers.add_parser("summary", help="write merger counts of a sample of subhalos")
+	parser_summary.add_argument("basedir")
+	parser_summary.add_argument("skipfac", type=int)
+	parser_summary.add_argument("snapnum", type=int)
+	parser_summary.add_argument("idfile", help="text file of subhalo numbers at snapnum")
+	parser_summary.add_argument("outfile", help=".npz file of columns")
+	parser_summary.add_argument("--ratios", type=float, nargs="+", default=[0.25, 0.1, 0.01])
+	parser_summary.add_argument("--snaps", type=int, nargs="+", default=[128, 97], help="count mergers after these snapshots")
+	parser_summary.add_argument("--ratio-at", choices=["max", "merger"], default="max")
+	parser_summary.add_argument("--lookup-base", default=None, help="directory of the subhalo lookup (default: an existing one in basedir, else ~/.cache/mergertreeHDF5)")
+	args = parser.parse_args()
+
+	if (args.command == "summary"):
+		subhalo_nums = np.genfromtxt(args.idfile, dtype=np.int64)
+		merger_summary(args.basedir, args.skipfac, args.snapnum, subhalo_nums, ratios = args.ratios, snap_cutoffs = args.snaps, ratio_at = args.ratio_at, lookup_base = args.lookup_base, outfile = args.outfile)
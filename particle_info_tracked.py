@@ -26,10 +26,11 @@ if rank==0:
     sub_ids = np.genfromtxt(id_file, dtype=np.int32)
 
     if args.local:
-        cat = readsubfHDF5.subfind_catalog(args.local, snapnum, 
-                                           keysel=['GroupFirstSub','SubhaloGrNr'])
-        sat = np.zeros(cat.SubhaloGrNr.size, dtype=bool)
-        sat[sub_ids] = (sub_ids != cat.GroupFirstSub[cat.SubhaloGrNr[sub_ids]])
+        # only the rows of our subhalos and their groups are read
+        cat = readsubfHDF5.lazy_subfind_catalog(args.local, snapnum)
+        sat = np.zeros(cat.nsubs, dtype=bool)
+        grnr = cat.get_rows('SubhaloGrNr', sub_ids)
+        sat[sub_ids] = (sub_ids != cat.get_rows('GroupFirstSub', grnr))
         del cat
         gc.collect()
 else:
@@ -47,42 +48,42 @@ dthresh = 6.4866e-4 # 0.13 cm^-3 in code units -> true for TNG?
 
 good_ids = np.where(my_subs > -1)[0]
 
-for sub_id in my_subs[good_ids]:
+reader = readhaloHDF5.SnapshotHaloReader(args.local, snapnum, long_ids=True,
+                                         double_output=False)
+
+gas_sweep = reader.iter_subhalos(0, my_subs[good_ids], ["POS ", "MASS", "RHO ", "SFR "],
+                                 out={}, dtype="float32")
+star_sweep = reader.iter_subhalos(4, my_subs[good_ids], ["POS ", "MASS", "GAGE"],
+                                  out={}, dtype="float32")
+
+for sub_id in np.sort(my_subs[good_ids]):
 
     # Get half mass radius
     sub = get(url_sbhalos+str(sub_id))
 
     gas = True
 
-    readhaloHDF5.reset()
-
-    try:
-        # Gas
-        coords = readhaloHDF5.readhalo(args.local, "snap", snapnum, 
-                                       "POS ", 0, -1, sub_id, long_ids=True,
-                                       double_output=False).astype("float32")
-        mass = readhaloHDF5.readhalo(args.local, "snap", snapnum, 
-                                     "MASS", 0, -1, sub_id, long_ids=True,
-                                     double_output=False).astype("float32")
-        dens = readhaloHDF5.readhalo(args.local, "snap", snapnum, 
-                                     "RHO ", 0, -1, sub_id, long_ids=True,
-                                     double_output=False).astype("float32")
-        sfr = readhaloHDF5.readhalo(args.local, "snap", snapnum, 
-                                    "SFR ", 0, -1, sub_id, long_ids=True,
-                                    double_output=False).astype("float32")
-    except AttributeError:
+    # Gas
+    gas_data = readhaloHDF5.next_subhalo(gas_sweep, sub_id)
+    if gas_data is None:
         gas = False
+    else:
+        coords = gas_data["POS "]
+        mass = gas_data["MASS"]
+        dens = gas_data["RHO "]
+        sfr = gas_data["SFR "]
 
     # Stars
-    scoords = readhaloHDF5.readhalo(args.local, "snap", snapnum, 
-                                        "POS ", 4, -1, sub_id, long_ids=True,
-                                        double_output=False).astype("float32")
-    smass = readhaloHDF5.readhalo(args.local, "snap", snapnum, 
-                                      "MASS", 4, -1, sub_id, long_ids=True,
-                                      double_output=False).astype("float32")
-    a = readhaloHDF5.readhalo(args.local, "snap", snapnum, 
-                                  "GAGE", 4, -1, sub_id, long_ids=True,
-                                  double_output=False).astype("float32")
+    star_data = readhaloHDF5.next_subhalo(star_sweep, sub_id)
+    if star_data is None:
+        # no star particles: empty arrays, so all stellar masses are 0
+        scoords = np.zeros((0, 3))
+        smass = np.zeros(0)
+        a = np.zeros(0)
+    else:
+        scoords = star_data["POS "]
+        smass = star_data["MASS"]
+        a = star_data["GAGE"]
 
     my_particle_data[sub_id] = {}
 
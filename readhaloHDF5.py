@@ -7,171 +7,452 @@
 #subnr=1
 #readhaloHDF5.reset()
 #pos=readhaloHDF5.readhalo(base, "snap", snapnum, "POS ", type, grpnr, subnr, long_ids=True, double_output=False)
-
-import readsubfHDF5 
-import snapHDF5 
+#
+#when reading many subhalos, keep one reader around instead of calling reset() each time;
+#the subfind catalog and the offset tables are then only read once per process:
+#reader=readhaloHDF5.SnapshotHaloReader(base, snapnum, long_ids=True, double_output=False)
+#pos=reader.read("POS ", type, grpnr, subnr)
+#mass=reader.read("MASS", type, grpnr, subnr)
+#
+#several blocks of one subhalo can be read in a single pass over the chunk files:
+#gas=reader.read_fields(0, subnr, ["POS ", "MASS", "RHO "])
+#pos=gas["POS "]
+#
+#or for a whole batch of subhalos, sweeping through the chunk files once:
+#for subnr, gas in reader.iter_subhalos(0, subnrs, ["POS ", "MASS"]):
+#	...
+#
+#dtype converts while reading, and out={} keeps buffers that are reused from call to call:
+#buf={}
+#pos=reader.read("POS ", type, grpnr, subnr, out=buf, dtype="float32")
+#
+#with SnapshotHaloReader(..., mmap=True) (h5py only) subhalos within one chunk file are returned
+#as read-only views into the file where the datasets are stored contiguous and unfiltered
+
+import readsubfHDF5
+import snapHDF5
+import hdf5lib
 import numpy as np
 import os
 import sys
 
-FlagRead, cat,GroupOffset, HaloOffset, multiple, filename, Parttype, FileTypeNumbers, FileNum = False, None, None, None, None, None, [], None, None
-
-def reset():
-        global FlagRead, cat, GroupOffset, HaloOffset, multiple, filename, Parttype, FileTypeNumbers, FileNum
-        FlagRead, cat, GroupOffset, HaloOffset, multiple, filename, Parttype, FileTypeNumbers, FileNum = False, None, None, None, None, None, [], None, None
-
-
-
-def readhalo(base, snapbase, num, block_name, parttype, fof_num, sub_num, long_ids=False, double_output=False, verbose=False):
-	global FlagRead, cat, GroupOffset, HaloOffset, multiple, filename, Parttype, FileTypeNumbers, FileNum
-
-
-	if (FlagRead==False) | ((parttype in Parttype) == False):	
+#directory for the offset table sidecar files; set to None to disable caching
+default_cachedir = os.path.join(os.path.expanduser("~"), ".cache", "readhaloHDF5")
+
+
+###########################
+#OFFSET TABLE CONSTRUCTION#
+###########################
+#particles are stored group by group, and within each group subhalo by subhalo,
+#so both offset tables follow from cumulative sums of the length tables
+def construct_offsets(GroupLenType, GroupNsubs, SubhaloLenType):
+	ngroups = GroupLenType.shape[0]
+	nsubs = SubhaloLenType.shape[0]
+	if (GroupNsubs.sum() != nsubs):
+		print("READHALO: problem with offset table", GroupNsubs.sum(), nsubs)
+		sys.exit()
+
+	GroupOffset = np.zeros([ngroups, 6], dtype="int64")
+	np.cumsum(GroupLenType[:-1, :], axis=0, dtype="int64", out=GroupOffset[1:, :])
+
+	SubhaloCum = np.zeros([nsubs, 6], dtype="int64")
+	np.cumsum(SubhaloLenType[:-1, :], axis=0, dtype="int64", out=SubhaloCum[1:, :])
+
+	#first subhalo and group of every subhalo, counted in catalog order
+	firstsub = np.cumsum(GroupNsubs, dtype="int64") - GroupNsubs
+	grnr = np.repeat(np.arange(ngroups), GroupNsubs)
+
+	HaloOffset = GroupOffset[grnr, :] + SubhaloCum - SubhaloCum[firstsub[grnr], :]
+
+	return GroupOffset, HaloOffset
+
+
+#read group/subhalo and chunk file offsets from a published offsets_NNN.hdf5 file;
+#both the TNG layout (Group/SnapByType, Subhalo/SnapByType, FileOffsets/SnapByType)
+#and the older SnapOffsetsGroup/SnapOffsetsSubhalo layout are understood
+def read_offsetfile(filename, ngroups, nsubs):
+	f=hdf5lib.OpenFile(filename)
+	GroupOffset = read_offset_table(f, ["Group/SnapByType", "SnapOffsetsGroup"], ngroups)
+	HaloOffset = read_offset_table(f, ["Subhalo/SnapByType", "SnapOffsetsSubhalo"], nsubs)
+	FileTypeNumbers = read_offset_table(f, ["FileOffsets/SnapByType", "FileOffsets/Snap"], -1)
+	f.close()
+	if (GroupOffset is None) | (HaloOffset is None):
+		return None, None, None
+	return GroupOffset, HaloOffset, FileTypeNumbers
+
+
+def read_offset_table(f, dnames, nrows):
+	for dname in dnames:
+		gname, cname = os.path.split(dname)
+		if (gname != "") and (hdf5lib.Contains(f, "", gname) == False):
+			continue
+		if (hdf5lib.Contains(f, gname, cname) == False):
+			continue
+		table = np.asarray(hdf5lib.GetData(f, dname)[:], dtype="int64")
+		#some releases store the tables as [6, N]
+		if (table.ndim == 2) and (table.shape[0] == 6) and (table.shape[1] != 6):
+			table = table.T.copy()
+		if (table.ndim != 2) or (table.shape[1] != 6) or ((nrows >= 0) and (table.shape[0] != nrows)):
+			return None
+		return table
+	return None
+
+
+#the cache is only used while the catalog files have the sizes and modification times
+#(signature, see hdf5lib.FileSignature) stored next to it in <cachename>.sig.npy
+def load_offset_cache(cachename, nrows, signature, verbose=False):
+	if (os.path.exists(cachename)==False):
+		return None
+	#signature first: it is written after the offsets, so a matching one never goes with older offsets
+	try:
+		cached_signature = np.load(cachename+".sig.npy")
+		offsets = np.load(cachename, mmap_mode="r")
+	except (OSError, ValueError):
+		return None
+	if (offsets.shape != (nrows, 6)) | (offsets.dtype != np.int64) | (np.array_equal(cached_signature, np.asarray(signature, dtype="int64"))==False):
 		if (verbose):
-			print("READHALO: INITIAL READ")
+			print("READHALO: ignoring stale offset cache :", cachename)
+		return None
+	if (verbose):
+		print("READHALO: mapped offset cache :", cachename)
+	return offsets
 
-		#add parttype to list
-		Parttype.append(parttype)
 
-		if (verbose):
-			print("READHALO: Parttype = ", Parttype)
+def save_offset_cache(cachename, offsets, signature, verbose=False):
+	#write to private files first, so other ranks never map a partial table
+	for name, data in [(cachename, offsets), (cachename+".sig.npy", np.asarray(signature, dtype="int64"))]:
+		try:
+			hdf5lib.WriteAtomic(name, lambda f: np.save(f, data))
+		except OSError:
+			if (verbose):
+				print("READHALO: could not write offset cache :", name)
+			return
+	if (verbose):
+		print("READHALO: wrote offset cache :", cachename)
+
+
+######################
+#SNAPSHOT HALO READER#
+######################
+class SnapshotHaloReader:
+	def __init__(self, base, snapnum, snapbase="snap", long_ids=False, double_output=False, cachedir=default_cachedir, mmap=False, verbose=False):
+		self.base = base
+		self.snapnum = snapnum
+		self.snapbase = snapbase
+		self.long_ids = long_ids
+		self.double_output = double_output
+		self.cachedir = cachedir
+		self.mmap = mmap
+		self.verbose = verbose
+		self.reset()
+
+	#drop catalog, offset and file tables; they are rebuilt on the next read
+	def reset(self):
+		self.FlagRead = False
+		self.cat = None
+		self.GroupOffset = None
+		self.HaloOffset = None
+		self.multiple = None
+		self.FileTypeNumbers = None
+		self.FileNpart = None
+		self.FileNum = None
+
+	def get_filename(self, fnr):
+		if (self.multiple):
+			return self.base+"/snapdir_"+str(self.snapnum).zfill(3)+"/"+self.snapbase+"_"+str(self.snapnum).zfill(3)+"."+str(fnr)
+		else:
+			return self.base+"/"+self.snapbase+"_"+str(self.snapnum).zfill(3)
+
+	#offsets file published with the simulation, searched for under the base directory
+	def get_offsetfile(self):
+		name = "offsets_"+str(self.snapnum).zfill(3)+".hdf5"
+		for dirname in ["", "offsets/", "postprocessing/offsets/", "../postprocessing/offsets/"]:
+			if os.path.exists(self.base+"/"+dirname+name):
+				return self.base+"/"+dirname+name
+		return None
+
+	#sidecar file for the offset tables, keyed by snapshot path and number
+	def get_cachename(self):
+		return self.cachedir+"/offsets_"+str(self.snapnum).zfill(3)+"_"+hdf5lib.CacheKey(os.path.abspath(self.base), self.snapbase)+".npy"
+
+	#read catalog and construct offset and file tables for all particle types at once
+	def load(self):
+		if (self.verbose):
+			print("READHALO: INITIAL READ")
 
 		#read in catalog
-		cat = readsubfHDF5.subfind_catalog(base, num, long_ids=long_ids, double_output=double_output, keysel=["GroupLenType","GroupNsubs","GroupFirstSub","SubhaloLenType","SubhaloMassType"])
+		#fields are read as they are used; with published or cached offsets only the length tables are needed
+		self.cat = readsubfHDF5.lazy_subfind_catalog(self.base, self.snapnum, long_ids=self.long_ids, double_output=self.double_output)
+		cat = self.cat
 
 		if (cat.ngroups==0):
-			if (verbose):
+			if (self.verbose):
 				print("READHALO: no groups in catalog... returning")
 			return
 
-		
-		if (FlagRead==False):
-			GroupOffset = np.zeros([cat.ngroups, 6], dtype="int64")
-			HaloOffset = np.zeros([cat.nsubs, 6], dtype="int64")
-	
-			filename = base+"/"+snapbase+"_"+str(num).zfill(3)
-			multiple=False
-			if (os.path.exists(filename+".hdf5")==False):
-				filename = base+"/snapdir_"+str(num).zfill(3)+"/"+snapbase+"_"+str(num).zfill(3)+"."+str(0)
-				multiple=True
-			if (os.path.exists(filename+".hdf5")==False):
-				print("READHALO: [error] file not found : ", filename)
-				sys.exit()
-
-			FlagRead=True
-
-
-		#construct offset tables
-		k=0
-		for i in range(0, cat.ngroups):
-			if (i>0):
-				GroupOffset[i, parttype] =  GroupOffset[i-1, parttype] + cat.GroupLenType[i-1, parttype]
-			if (cat.GroupNsubs[i]>0):
-				HaloOffset[k, parttype] = GroupOffset[i, parttype]
-				k+=1
-				for j in range(1, cat.GroupNsubs[i]):
-					HaloOffset[k, parttype] =  HaloOffset[k-1, parttype] + cat.SubhaloLenType[k-1, parttype]
-					k+=1
-		if (k!=cat.nsubs):
-			print("READHALO: problem with offset table", k, cat.nsubs)
+		self.multiple=False
+		if (os.path.exists(self.get_filename(0)+".hdf5")==False):
+			self.multiple=True
+		if (os.path.exists(self.get_filename(0)+".hdf5")==False):
+			print("READHALO: [error] file not found : ", self.get_filename(0))
 			sys.exit()
 
+		#offsets published with the simulation (TNG offsets_NNN.hdf5) take precedence
+		offsetfile = self.get_offsetfile()
+		if (offsetfile != None):
+			if (self.verbose):
+				print("READHALO: reading offsets file :", offsetfile)
+			self.GroupOffset, self.HaloOffset, FileTypeNumbers = read_offsetfile(offsetfile, cat.ngroups, cat.nsubs)
+			if (self.GroupOffset is None):
+				if (self.verbose):
+					print("READHALO: offsets file does not match catalog... constructing offsets")
+				offsetfile = None
+			elif (self.multiple):
+				self.FileTypeNumbers = FileTypeNumbers
+
+		#construct offset tables (or map them from the sidecar cache of an earlier run)
+		if (offsetfile == None):
+			offsets = None
+			if (self.cachedir != None):
+				signature = hdf5lib.FileSignature(cat.curfiles)
+				offsets = load_offset_cache(self.get_cachename(), cat.ngroups + cat.nsubs, signature, verbose=self.verbose)
+			if (offsets is None):
+				GroupOffset, HaloOffset = construct_offsets(cat.GroupLenType, cat.GroupNsubs, cat.SubhaloLenType)
+				offsets = np.concatenate((GroupOffset, HaloOffset))
+				if (self.cachedir != None):
+					save_offset_cache(self.get_cachename(), offsets, signature, verbose=self.verbose)
+			self.GroupOffset = offsets[:cat.ngroups]
+			self.HaloOffset = offsets[cat.ngroups:]
+
 		#construct file tables
-		if (multiple):
-			filename = base+"/snapdir_"+str(num).zfill(3)+"/"+snapbase+"_"+str(num).zfill(3)+"."+str(0)
-		else:
-			filename = base+"/"+snapbase+"_"+str(num).zfill(3)
+		head = snapHDF5.snapshot_header(self.get_filename(0))
+		self.FileNum = int(head.filenum) if (self.multiple) else 1
 
-		head = snapHDF5.snapshot_header(filename)
-		FileNum = head.filenum+1
+		if (self.FileTypeNumbers is not None) and (self.FileTypeNumbers.shape[0] == self.FileNum):
+			#per-file counts follow from the published file offsets and the total count
+			nall = head.nall.astype("int64") + (head.nall_highword.astype("int64") << 32)
+			self.FileNpart = np.diff(np.concatenate((self.FileTypeNumbers, nall.reshape(1, 6))), axis=0)
+		else:
+			#otherwise from the snapshot index (one header read per chunk file, shared with snapHDF5)
+			index, fnr = snapHDF5.get_index(self.get_filename(0), verbose=self.verbose)
+			self.FileNpart = index.npart
+
+			self.FileTypeNumbers = np.zeros([self.FileNum, 6], dtype="int64")
+			self.FileTypeNumbers[1:, :] = np.cumsum(self.FileNpart[:-1, :], axis=0)
+
+		self.FlagRead=True
+
+	#particle offset and count of the requested halo/fof/etc for one particle type
+	def get_span(self, parttype, fof_num, sub_num):
+		cat = self.cat
+
+		if (sub_num>=0) & (fof_num < 0):
+			off = self.HaloOffset[sub_num, parttype]
+			left = cat.SubhaloLenType[sub_num, parttype]
+			if (self.verbose):
+				print("READHALO: nr / particle # / mass :", sub_num, cat.SubhaloLenType[sub_num, parttype], cat.SubhaloMassType[sub_num, parttype].astype("float64"))
+		if (fof_num>=0) & (sub_num < 0):
+			off = self.GroupOffset[fof_num, parttype]
+			left = cat.GroupLenType[fof_num, parttype]
+			if (self.verbose):
+				print("READHALO: nr / particle # :", fof_num, cat.GroupLenType[fof_num, parttype])
+		if (sub_num>=0) & (fof_num>=0):
+			real_sub_num = sub_num + cat.GroupFirstSub[fof_num]
+			off = self.HaloOffset[real_sub_num, parttype]
+			left = cat.SubhaloLenType[real_sub_num, parttype]
+			if (self.verbose):
+				print("READHALO: nr / particle # / mass :", real_sub_num, cat.SubhaloLenType[real_sub_num, parttype], cat.SubhaloMassType[real_sub_num, parttype].astype("float64"))
+
+		return int(off), int(left)
+
+	#split a particle span into [filename, start, count] slabs of the chunk files
+	def get_slabs(self, parttype, off, left):
+		#get first file that contains particles of required halo/fof/etc
+		findex = np.argmax(self.FileTypeNumbers[:, parttype] > off) - 1
+		#in case we reached the end argmax returns 0
+		if (findex == -1):
+			findex = self.FileNum - 1
+
+		if (self.verbose):
+			print("READHALO: first file that contains particles =", findex)
+
+		off -= self.FileTypeNumbers[findex, parttype]
+
+		slabs = []
+		for fnr in range(findex, self.FileNum):
+			nloc = self.FileNpart[fnr, parttype]
+
+			if (nloc > off):
+				start = off
+				if (nloc - off > left):
+					count = left
+				else:
+					count = nloc - off
+				slabs.append([self.get_filename(fnr), int(start), int(count)])
+
+				left -= count
+				off += count
+			if (left==0):
+				break
+			off -= nloc
+
+		return slabs
+
+	#out ({block_name: array}) and dtype as in read_span
+	def read(self, block_name, parttype, fof_num=-1, sub_num=-1, out=None, dtype=None):
+		if (self.FlagRead==False):
+			self.load()
+			if (self.FlagRead==False):
+				return
+
+		off, left = self.get_span(parttype, fof_num, sub_num)
+		if (left==0):
+			if (self.verbose):
+				print("READHALO: no particles of type... returning")
+			return
 
-		FileTypeNumbers = np.zeros([FileNum, 6], dtype="int64") 
-		cumcount = np.zeros(6, dtype="int64")
+		return self.read_span(parttype, off, left, [block_name], out, dtype)[block_name]
 
-		for fnr in range(0, FileNum-1):
-			if (multiple):
-				filename = base+"/snapdir_"+str(num).zfill(3)+"/"+snapbase+"_"+str(num).zfill(3)+"."+str(fnr)
-			else:
-				filename = base+"/"+snapbase+"_"+str(num).zfill(3)
+	#read several blocks of one subhalo (or fof group with fof_num>=0 and sub_num<0)
+	#in a single pass: each chunk file is opened once and all blocks are read over the
+	#same slab; returns {block: array}, or None if there are no particles of that type
+	def read_fields(self, parttype, sub_num, blocks, fof_num=-1, out=None, dtype=None):
+		if (self.FlagRead==False):
+			self.load()
+			if (self.FlagRead==False):
+				return
 
-			if (verbose):
-				print("READHALO: initial reading file :", filename)
-
-			head = snapHDF5.snapshot_header(filename)
-	
-			cumcount[:] += head.npart[:]
-			FileTypeNumbers[fnr+1, :] = cumcount[:]
-			
-	
-	if (sub_num>=0) & (fof_num < 0):
-		off = HaloOffset[sub_num, parttype]
-		left = cat.SubhaloLenType[sub_num, parttype]
-		if (verbose):
-			print("READHALO: nr / particle # / mass :", sub_num, cat.SubhaloLenType[sub_num, parttype], cat.SubhaloMassType[sub_num, parttype].astype("float64"))
-	if (fof_num>=0) & (sub_num < 0):
-		off = GroupOffset[fof_num, parttype]
-		left = cat.GroupLenType[fof_num, parttype]
-		if (verbose):
-			print("READHALO: nr / particle # / mass :", fof_num, cat.GroupLenType[fof_num, parttype], cat.GroupMassType[fof_num, parttype].astype("float64"))
-	if (sub_num>=0) & (fof_num>=0):
-		real_sub_num = sub_num + cat.GroupFirstSub[fof_num]
-		off = HaloOffset[real_sub_num, parttype]
-		left = cat.SubhaloLenType[real_sub_num, parttype]
-		if (verbose):
-			print("READHALO: nr / particle # / mass :", real_sub_num, cat.SubhaloLenType[real_sub_num, parttype], cat.SubhaloMassType[real_sub_num, parttype].astype("float64"))
-		
+		off, left = self.get_span(parttype, fof_num, sub_num)
+		if (left==0):
+			if (self.verbose):
+				print("READHALO: no particles of type... returning")
+			return
 
-	if (left==0):
-		if (verbose):
-			print("READHALO: no particles of type... returning")
-		return
+		return self.read_span(parttype, off, left, blocks, out, dtype)
+
+	#read blocks for the particles [off, off+left) of one type across the chunk files;
+	#the output is allocated once from the layout of the first file and every slab is read into it
+	#in place. With out ({block: array}) the caller's buffers are reused, and replaced in out by
+	#larger ones only when they are too small; dtype converts the data while reading.
+	#With mmap set on the reader, a span within one chunk file is returned as read-only memmap
+	#views where the datasets are stored contiguous and unfiltered (see snapHDF5.read_block).
+	def read_span(self, parttype, off, left, blocks, out=None, dtype=None):
+		slabs = self.get_slabs(parttype, off, left)
+		if (self.mmap) & (out is None) & (dtype is None) & (len(slabs)==1):
+			filename, start, count = slabs[0]
+			return snapHDF5.read_blocks_single_file(filename, blocks, parttype, slab_start=start, slab_len=count, mmap=True, verbose=self.verbose)
+		layout = snapHDF5.read_blocks_layout(slabs[0][0], blocks, parttype)
+
+		data = {}
+		for block in blocks:
+			block_dtype, shape = layout[block]
+			if (dtype is not None):
+				block_dtype = np.dtype(dtype)
+			if (out is None):
+				data[block] = np.empty((left,)+shape, dtype=block_dtype)
+			else:
+				data[block] = get_buffer(out, block, (left,)+shape, block_dtype)
+
+		pos = 0
+		for filename, start, count in slabs:
+			if (self.verbose):
+				print("READHALO: reading file :", filename)
+			snapHDF5.read_blocks_single_file(filename, blocks, parttype, slab_start=start, slab_len=count, out=dict([(block, data[block][pos:pos+count]) for block in blocks]), verbose=self.verbose)
+			pos += count
+
+		return data
+
+	#generator over a batch of subhalos: yields (sub_num, {block: array}) in file order,
+	#which is ascending subhalo number, so sweeps for different particle types can be zipped,
+	#or stepped along a loop over the sorted subhalo numbers with next_subhalo(). One reader
+	#(per MPI rank) serves all sweeps, so the catalog and offset tables are read only once.
+	#Subhalos whose particles lie within max_gap particles of each other are read together
+	#with one slab per chunk file, as long as the combined span stays below max_span particles.
+	#The yielded arrays are views into the combined read; copy them to keep them around.
+	#Subhalos without particles of that type yield None. With out (a dict, e.g. {}) all runs
+	#are read into one set of buffers reused across the sweep, so the yielded arrays are only
+	#valid until the next run is read.
+	def iter_subhalos(self, parttype, sub_nums, blocks, max_gap=65536, max_span=2097152, out=None, dtype=None):
+		if (self.FlagRead==False):
+			self.load()
+			if (self.FlagRead==False):
+				return
+
+		sub_nums = np.asarray(sub_nums, dtype="int64")
+		offs = np.asarray(self.HaloOffset[sub_nums, parttype], dtype="int64")
+		lens = np.asarray(self.cat.SubhaloLenType[sub_nums, parttype], dtype="int64")
+		order = np.lexsort((sub_nums, offs))
+
+		i = 0
+		while (i < order.size):
+			#plan a run of nearby subhalos
+			run_start = offs[order[i]]
+			run_end = run_start + lens[order[i]]
+			j = i + 1
+			while (j < order.size):
+				k = order[j]
+				if (offs[k] - run_end > max_gap) | (max(run_end, offs[k] + lens[k]) - run_start > max_span):
+					break
+				run_end = max(run_end, offs[k] + lens[k])
+				j += 1
+
+			if (self.verbose):
+				print("READHALO: sweep run of", j - i, "subhalos, particles", run_start, run_end)
+
+			if (run_end > run_start):
+				data = self.read_span(parttype, run_start, run_end - run_start, blocks, out, dtype)
+
+			for k in order[i:j]:
+				if (lens[k] == 0):
+					yield sub_nums[k], None
+				else:
+					first = offs[k] - run_start
+					yield sub_nums[k], dict([(block, data[block][first:first + lens[k]]) for block in blocks])
+
+			i = j
+
+
+
+#data of the next subhalo of an iter_subhalos sweep, which must be sub_num (the caller's loop
+#runs over the same subhalos in ascending order)
+def next_subhalo(sweep, sub_num):
+	sweep_num, data = next(sweep)
+	if (sweep_num != sub_num):
+		raise ValueError("subhalo sweep is at "+str(sweep_num)+", not at "+str(sub_num))
+	return data
 
 
-	#get first file that contains particles of required halo/fof/etc
-	findex = np.argmax(FileTypeNumbers[:, parttype] > off) - 1
-	#in case we reached the end argmax returns 0
-	if (findex == -1): 
-		findex = FileNum - 1
+##################
+#REUSABLE BUFFERS#
+##################
+#first shape[0] rows of the buffer out[block], which is replaced by a larger one
+#(with some headroom) only if it is too small or of a different type/shape
+def get_buffer(out, block, shape, dtype):
+	buf = out.get(block)
+	if (buf is None) or (buf.dtype != dtype) or (buf.shape[1:] != shape[1:]) or (buf.shape[0] < shape[0]):
+		nrows = shape[0]
+		if (buf is not None) and (buf.dtype == dtype) and (buf.shape[1:] == shape[1:]):
+			nrows = max(nrows, int(1.5*buf.shape[0]))
+		out[block] = np.empty((nrows,)+shape[1:], dtype=dtype)
+	return out[block][:shape[0]]
 
-	if (verbose):
-		print("READHALO: first file that contains particles =", findex)
 
-	for fnr in range(0, findex):
-		off -= FileTypeNumbers[fnr+1, parttype] - FileTypeNumbers[fnr, parttype] 
+############################
+#MODULE LEVEL READER ACCESS#
+############################
+#readhalo() keeps a single reader per (base, snapbase, num); reset() discards it
+reader = None
 
-	#read data from file
-	first=True
-	for fnr in range(findex, FileNum):
-		if (multiple):
-			filename = base+"/snapdir_"+str(num).zfill(3)+"/"+snapbase+"_"+str(num).zfill(3)+"."+str(fnr)
-		else:
-			filename = base+"/"+snapbase+"_"+str(num).zfill(3)
-	
-		if (verbose):
-			print("READHALO: reading file :", filename)
-	
-		head = snapHDF5.snapshot_header(filename)
-		nloc = head.npart[parttype]
+def reset():
+	global reader
+	reader = None
 
-		if (nloc > off):
-			if (verbose):
-				print("READHALO: data")
-			start = off
-			if (nloc - off > left):
-				count = left	
-			else:
-				count = nloc - off
 
-			if (first==True):	
-				data = snapHDF5.read_block(filename, block_name, parttype, slab_start=start, slab_len=count)
-				first=False
-			else:
-				data = np.append(data, snapHDF5.read_block(filename, block_name, parttype, slab_start=start, slab_len=count), axis=0)
+def readhalo(base, snapbase, num, block_name, parttype, fof_num, sub_num, long_ids=False, double_output=False, verbose=False, out=None, dtype=None):
+	global reader
 
-			left -= count
-			off += count
-		if (left==0):
-			break
-		off -= nloc
+	if (reader is None) or ((reader.base, reader.snapbase, reader.snapnum, reader.long_ids, reader.double_output) != (base, snapbase, num, long_ids, double_output)):
+		reader = SnapshotHaloReader(base, num, snapbase=snapbase, long_ids=long_ids, double_output=double_output, verbose=verbose)
+	reader.verbose = verbose
 
-	return data
+	return reader.read(block_name, parttype, fof_num, sub_num, out, dtype)
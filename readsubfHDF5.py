@@ -5,12 +5,18 @@
 # cat = readsubfHDF5.subfind_catalog("./output/", 60)
 # print cat.SubhaloPos
 #
+# or, reading each field only when it is first used:
+# cat = readsubfHDF5.lazy_subfind_catalog("./output/", 60)
+# print cat.SubhaloPos
+#
 #
 # Mark Vogelsberger (mvogelsb@cfa.harvard.edu)
 
 import numpy as np
 import os
 import sys
+import json
+import concurrent.futures
 import hdf5lib 
 
 ####################
@@ -84,162 +90,437 @@ grp_datablocks = {"GroupLen":["INT",1],
                   "GroupBHMdot":["FLOAT",1], 
 		  "GroupFuzzOffsetType":["INT64",6]}
 
+#number of chunk files read at once by separate threads; the threads only help with h5py
+#(PyTables is not thread safe, so it always reads one file after the other)
+default_nthreads = 4
+
+#numbers of groups and subhalos in one chunk file
+def read_counts(curfile):
+	f=hdf5lib.OpenFileDirect(curfile)
+	ngroups = int(hdf5lib.GetAttr(f, "Header", "Ngroups_ThisFile"))
+	nsubs = int(hdf5lib.GetAttr(f, "Header", "Nsubgroups_ThisFile"))
+	f.close()
+	return ngroups, nsubs
+
+#read every field [gname, key, array] of one chunk file into its rows of the catalog arrays;
+#contiguous datasets are copied from a memory map, which runs without holding the interpreter lock
+def read_file(curfile, fields, ngroups, nsubs, skip_gr, skip_sub):
+	f=hdf5lib.OpenFileDirect(curfile)
+	for gname, key, arr in fields:
+		if (gname == "Group"):
+			skip, n = skip_gr, ngroups
+		else:
+			skip, n = skip_sub, nsubs
+		if (n > 0) and hdf5lib.Contains(f, gname, key):
+			datamap = hdf5lib.GetDataMap(f, gname+"/"+key)
+			if (datamap is not None):
+				arr[skip:skip + n] = datamap
+			else:
+				hdf5lib.ReadData(f, gname+"/"+key, 0, n, arr[skip:skip + n])
+	f.close()
+
+#given rows (any order, repeats allowed) of a field: each row is mapped to its chunk file with
+#the prefix sums of the per-file counts, and only those rows are read from each file
+def read_rows(curfiles, counts, skips, gname, key, rows, shape, dtype):
+	col = 0 if (gname == "Group") else 1
+	rows = np.asarray(rows, dtype="int64")
+	urows, inverse = np.unique(rows, return_inverse=True)
+	out = np.empty((urows.size,)+tuple(shape[1:]), dtype=dtype)
+	if (urows.size > 0) and ((urows[0] < 0) or (urows[-1] >= counts[:,col].sum())):
+		print("row index out of range for", key)
+		sys.exit()
+
+	fnrs = np.searchsorted(skips[:,col] + counts[:,col], urows, side="right")
+	bounds = np.searchsorted(fnrs, np.arange(len(curfiles)+1))
+	for num in np.unique(fnrs):
+		sel = slice(bounds[num], bounds[num+1])
+		f=hdf5lib.OpenFile(curfiles[num])
+		out[sel] = hdf5lib.ReadRows(f, gname+"/"+key, urows[sel] - skips[num,col])
+		f.close()
+
+	return out[inverse.reshape(rows.shape)]
+
+#catalog file base name and first file (a single file catalog has no "groups_NNN" directory)
+def catalog_files(basedir, snapnum, name):
+	filebase = basedir + "/groups_" + str(snapnum).zfill(3) + "/" + name + "_" + str(snapnum).zfill(3) + "."
+	curfile = filebase + "0.hdf5"
+	if (not os.path.exists(curfile)):
+		filebase = basedir + "/" + name + "_" + str(snapnum).zfill(3)
+		curfile = filebase + ".hdf5"
+	if (not os.path.exists(curfile)):
+		print("file not found:", curfile)
+		sys.exit()
+	return filebase, curfile
+
+#counts [ngroups, nsubs] of every chunk file and the rows at which each file starts
+def read_all_counts(curfiles, nthreads):
+	if (nthreads > 1) & (len(curfiles) > 1) & (hdf5lib.use_tables == False):
+		with concurrent.futures.ThreadPoolExecutor(max_workers=nthreads) as executor:
+			counts = list(executor.map(read_counts, curfiles))
+	else:
+		counts = [read_counts(curfile) for curfile in curfiles]
+	counts = np.array(counts, dtype="int64").reshape(-1, 2)
+	return counts, np.cumsum(counts, axis=0) - counts
+
+#read fields from all chunk files into their rows, several files at once with h5py
+def read_all_files(curfiles, fields, counts, skips, nthreads):
+	if (nthreads > 1) & (len(curfiles) > 1) & (hdf5lib.use_tables == False):
+		with concurrent.futures.ThreadPoolExecutor(max_workers=nthreads) as executor:
+			list(executor.map(read_file, curfiles, [fields]*len(curfiles), counts[:,0], counts[:,1], skips[:,0], skips[:,1]))
+	else:
+		for num, curfile in enumerate(curfiles):
+			read_file(curfile, fields, counts[num,0], counts[num,1], skips[num,0], skips[num,1])
+
 class subfind_catalog:
-	def __init__(self, basedir, snapnum, long_ids = False, double_output = False, grpcat = True, subcat = True, name = "fof_subhalo_tab", keysel = None):
-		self.filebase = basedir + "/groups_" + str(snapnum).zfill(3) + "/" + name + "_" + str(snapnum).zfill(3) + "."
+	#with subhalo_rows/group_rows (arrays of indices) the subhalo/group fields hold only those rows;
+	#columns is the directory of a consolidated column cache (None: the default one if present, False: never)
+	def __init__(self, basedir, snapnum, long_ids = False, double_output = False, grpcat = True, subcat = True, name = "fof_subhalo_tab", keysel = None, nthreads = None, subhalo_rows = None, group_rows = None, columns = None):
+		self.filebase, curfile = catalog_files(basedir, snapnum, name)
  
 		if long_ids: self.id_type = np.uint64
 		else: self.id_type = np.uint32
 		if double_output: self.double_type = np.float32
 		else: self.double_type = np.float64
 
-		filenum = 0
-		doneflag = False
-		skip_gr = 0
-		skip_sub = 0
-		vardict = {}
-
-		while not doneflag:
-			curfile = self.filebase + str(filenum) + ".hdf5"
-
-			if (not os.path.exists(curfile)):
-				self.filebase = basedir + "/" + name + "_" + str(snapnum).zfill(3)
-				curfile = self.filebase + ".hdf5"
-			if (not os.path.exists(curfile)):
-				print("file not found:", curfile)
-				sys.exit()
-
-			f=hdf5lib.OpenFile(curfile)     
-			ngroups = hdf5lib.GetAttr(f, "Header", "Ngroups_ThisFile") 
-			nsubs = hdf5lib.GetAttr(f, "Header", "Nsubgroups_ThisFile")
-			nfiles = hdf5lib.GetAttr(f, "Header", "NumFiles")
-			if filenum == 0:
-				self.ngroups = hdf5lib.GetAttr(f, "Header", "Ngroups_Total")
-				self.nids = hdf5lib.GetAttr(f, "Header", "Nids_Total")
-				self.nsubs = hdf5lib.GetAttr(f, "Header", "Nsubgroups_Total")
-				#GROUPS
-				if (grpcat==True):
-					if (keysel == None):
-						for key, val in list(grp_datablocks.items()):
-							if hdf5lib.Contains(f, "Group", key):
-								type = val[0]
-								dim = val[1]
-								if (type=='FLOAT'):
-									vars(self)[key]=np.empty(self.ngroups, dtype=np.dtype((self.double_type,dim)))
-								if (type=='INT'):
-									vars(self)[key]=np.empty(self.ngroups, dtype=np.dtype((np.int32,dim)))
-								if (type=='INT64'):
-									vars(self)[key]=np.empty(self.ngroups, dtype=np.dtype((np.int64,dim)))
-								if (type=='ID'):
-									vars(self)[key]=np.empty(self.ngroups, dtype=np.dtype((self.id_type,dim)))
-								vardict[key]=vars(self)[key]
-					else:
-						for key in keysel:
-							if hdf5lib.Contains(f, "Group", key):
-								val = grp_datablocks[key]
-								type = val[0] 
-								dim = val[1]
-								if (type=='FLOAT'):
-									vars(self)[key]=np.empty(self.ngroups, dtype=np.dtype((self.double_type,dim)))
-								if (type=='INT'):
-									vars(self)[key]=np.empty(self.ngroups, dtype=np.dtype((np.int32,dim)))
-								if (type=='INT64'):
-									vars(self)[key]=np.empty(self.ngroups, dtype=np.dtype((np.int64,dim)))
-								if (type=='ID'):
-									vars(self)[key]=np.empty(self.ngroups, dtype=np.dtype((self.id_type,dim)))
-								vardict[key]=vars(self)[key]
-
-		
-				#SUBHALOS
-				if (subcat==True):
-					if (keysel == None):
-						for key, val in list(sub_datablocks.items()):
-							if hdf5lib.Contains(f, "Subhalo", key):
-								type = val[0]
-								dim = val[1]
-							if (type=='FLOAT'):
-								vars(self)[key]=np.empty(self.nsubs, dtype=np.dtype((self.double_type,dim)))
-							if (type=='INT'):
-								vars(self)[key]=np.empty(self.nsubs, dtype=np.dtype((np.int32,dim)))
-							if (type=='INT64'):
-								vars(self)[key]=np.empty(self.nsubs, dtype=np.dtype((np.int32,dim)))
-							if (type=='ID'):
-								vars(self)[key]=np.empty(self.nsubs, dtype=np.dtype((self.id_type,dim)))
-							vardict[key]=vars(self)[key]
-					else:
-						for key in keysel:
-							if hdf5lib.Contains(f, "Subhalo", key):
-								val = sub_datablocks[key]
-								type = val[0]
-								dim = val[1]
-								if (type=='FLOAT'):
-									vars(self)[key]=np.empty(self.nsubs, dtype=np.dtype((self.double_type,dim)))
-								if (type=='INT'):
-									vars(self)[key]=np.empty(self.nsubs, dtype=np.dtype((np.int32,dim)))
-								if (type=='INT64'):
-									vars(self)[key]=np.empty(self.nsubs, dtype=np.dtype((np.int64,dim)))
-								if (type=='ID'):
-									vars(self)[key]=np.empty(self.nsubs, dtype=np.dtype((self.id_type,dim)))
-								vardict[key]=vars(self)[key]
-
-			#GROUPS
-			if (grpcat==True):
-				if ngroups > 0:
-					if (keysel == None):
-						for key, val in list(grp_datablocks.items()):
-							if hdf5lib.Contains(f, "Group", key):
-								type = val[0]
-								dim = val[1]
-								a=hdf5lib.GetData(f, "Group/"+key)
-								if dim==1:
-									vardict[key][skip_gr:skip_gr + ngroups]=a[:]
-								else:
-									for d in range(0,dim):
-										vardict[key][skip_gr:skip_gr + ngroups,d]=a[:,d]
-					else:
-						for key in keysel:
-							if hdf5lib.Contains(f, "Group", key):
-								val = grp_datablocks[key]
-								type = val[0]
-								dim = val[1]
-								a=hdf5lib.GetData(f, "Group/"+key)
-								if dim==1:
-									vardict[key][skip_gr:skip_gr + ngroups]=a[:]
-								else:
-									for d in range(0,dim):
-										vardict[key][skip_gr:skip_gr + ngroups,d]=a[:,d]
-							
-					skip_gr += ngroups
-			#SUBHALOS 
-			if (subcat==True): 
-				if nsubs > 0:
-					if (keysel == None):
-						for key, val in list(sub_datablocks.items()):
-							if hdf5lib.Contains(f, "Subhalo", key):
-								type = val[0]
-								dim = val[1]
-								a=hdf5lib.GetData(f, "Subhalo/"+key)
-								if dim==1:
-									vardict[key][skip_sub:skip_sub + nsubs]=a[:]
-								else:
-									for d in range(0,dim):
-										vardict[key][skip_sub:skip_sub + nsubs,d]=a[:,d]
-					else:
-						for key in keysel:
-							if hdf5lib.Contains(f, "Subhalo", key):
-								val = sub_datablocks[key]
-								type = val[0]
-								dim = val[1]
-								a=hdf5lib.GetData(f, "Subhalo/"+key)
-								if dim==1:
-									vardict[key][skip_sub:skip_sub + nsubs]=a[:]
-								else:
-									for d in range(0,dim):
-										vardict[key][skip_sub:skip_sub + nsubs,d]=a[:,d]
-
-					skip_sub += nsubs      
-
-			f.close()
-
-			filenum += 1
-			if filenum == nfiles: doneflag = True
+		if (nthreads == None):
+			nthreads = default_nthreads
+
+		#totals and the fields present in the first file; the catalog arrays are allocated once
+		f=hdf5lib.OpenFile(curfile)
+		nfiles = hdf5lib.GetAttr(f, "Header", "NumFiles")
+		self.ngroups = hdf5lib.GetAttr(f, "Header", "Ngroups_Total")
+		self.nids = hdf5lib.GetAttr(f, "Header", "Nids_Total")
+		self.nsubs = hdf5lib.GetAttr(f, "Header", "Nsubgroups_Total")
+
+		specs = []
+		for gname, datablocks, nrows, flag, rows in [["Group", grp_datablocks, self.ngroups, grpcat, group_rows], ["Subhalo", sub_datablocks, self.nsubs, subcat, subhalo_rows]]:
+			if (flag==True):
+				if (keysel == None):
+					keys = list(datablocks.keys())
+				else:
+					keys = keysel
+				for key in keys:
+					if hdf5lib.Contains(f, gname, key):
+						type, dim = datablocks[key]
+						shape = (nrows,) if (dim==1) else (nrows, dim)
+						specs.append([gname, key, rows, shape, self.get_dtype(type)])
+		f.close()
+
+		if (nfiles > 1):
+			curfiles = [self.filebase + str(filenum) + ".hdf5" for filenum in range(0, nfiles)]
+		else:
+			curfiles = [curfile]
+
+		#fields in a consolidated column cache (see consolidate) are mapped from there
+		cols = open_columns(columns, basedir, snapnum, name, curfiles)
+
+		fields = []
+		subset_fields = []
+		for gname, key, rows, shape, dtype in specs:
+			if (cols is not None) and cols.has(key, dtype):
+				vars(self)[key] = cols.read(key, dtype, rows)
+			elif (rows is not None):
+				subset_fields.append([gname, key, rows, shape, dtype])
+			else:
+				vars(self)[key]=np.empty(shape, dtype=dtype)
+				fields.append([gname, key, vars(self)[key]])
+
+		#first the counts of all files give each file its rows, then the files are read in parallel
+		if (len(fields) > 0) or (len(subset_fields) > 0):
+			counts, skips = read_all_counts(curfiles, nthreads)
+			read_all_files(curfiles, fields, counts, skips, nthreads)
+			for gname, key, rows, shape, dtype in subset_fields:
+				vars(self)[key] = read_rows(curfiles, counts, skips, gname, key, rows, shape, dtype)
+
+	def get_dtype(self, type):
+		if (type=='FLOAT'):
+			return self.double_type
+		if (type=='INT'):
+			return np.int32
+		if (type=='INT64'):
+			return np.int64
+		if (type=='ID'):
+			return self.id_type
+
+
+######################
+#LAZY SUBFIND CATALOG#
+######################
+#same fields as subfind_catalog, but each one is read from the chunk files the first time it
+#is accessed (cat.SubhaloPos, ...) and then kept. With cachedir, every field read is also
+#stored there as a .npy file and memory mapped by later catalogs of the same snapshot, while
+#the chunk files have the sizes and modification times stored next to it in <field>.npy.sig.npy.
+class lazy_subfind_catalog(subfind_catalog):
+	def __init__(self, basedir, snapnum, long_ids = False, double_output = False, name = "fof_subhalo_tab", cachedir = None, nthreads = None, columns = None, verbose = False):
+		self.basedir = basedir
+		self.snapnum = snapnum
+		self.name = name
+		self.cachedir = cachedir
+		self.verbose = verbose
+		self.filebase, curfile = catalog_files(basedir, snapnum, name)
+
+		if long_ids: self.id_type = np.uint64
+		else: self.id_type = np.uint32
+		if double_output: self.double_type = np.float32
+		else: self.double_type = np.float64
+
+		if (nthreads == None):
+			nthreads = default_nthreads
+		self.nthreads = nthreads
+
+		f=hdf5lib.OpenFile(curfile)
+		nfiles = hdf5lib.GetAttr(f, "Header", "NumFiles")
+		self.ngroups = hdf5lib.GetAttr(f, "Header", "Ngroups_Total")
+		self.nids = hdf5lib.GetAttr(f, "Header", "Nids_Total")
+		self.nsubs = hdf5lib.GetAttr(f, "Header", "Nsubgroups_Total")
+		#fields present in the catalog
+		self.fields = {}
+		for gname, datablocks in [["Group", grp_datablocks], ["Subhalo", sub_datablocks]]:
+			for key in datablocks:
+				if hdf5lib.Contains(f, gname, key):
+					self.fields[key] = gname
+		f.close()
+
+		if (nfiles > 1):
+			self.curfiles = [self.filebase + str(filenum) + ".hdf5" for filenum in range(0, nfiles)]
+		else:
+			self.curfiles = [curfile]
+		self.counts = None
+		self.skips = None
+		self.cols = open_columns(columns, basedir, snapnum, name, self.curfiles, verbose)
+
+	#only called for attributes that are not set yet, i.e. fields that were not read so far
+	def __getattr__(self, key):
+		if (key.startswith("__")) or (key not in vars(self).get("fields", {})):
+			raise AttributeError(key)
+		vars(self)[key] = self.load_field(key)
+		return vars(self)[key]
+
+	def keys(self):
+		return list(self.fields.keys())
+
+	def get_field_info(self, key):
+		gname = self.fields[key]
+		if (gname == "Group"):
+			type, dim = grp_datablocks[key]
+			nrows = self.ngroups
+		else:
+			type, dim = sub_datablocks[key]
+			nrows = self.nsubs
+		shape = (nrows,) if (dim==1) else (nrows, dim)
+		return gname, shape, np.dtype(self.get_dtype(type))
+
+	#values of a field at the given rows (subhalo or group indices, in any order); unless the
+	#field is already loaded only the chunk files holding these rows are read, and only those rows
+	def get_rows(self, key, rows):
+		if (key in vars(self)):
+			return vars(self)[key][rows]
+		if (key not in self.fields):
+			raise AttributeError(key)
+		gname, shape, dtype = self.get_field_info(key)
+		if (self.cols is not None) and self.cols.has(key, dtype):
+			return self.cols.read(key, dtype, rows)
+		if (self.counts is None):
+			self.counts, self.skips = read_all_counts(self.curfiles, self.nthreads)
+		return read_rows(self.curfiles, self.counts, self.skips, gname, key, rows, shape, dtype)
+
+	def get_cachename(self, key):
+		return self.cachedir+"/"+self.name+"_"+str(self.snapnum).zfill(3)+"_"+hdf5lib.CacheKey(os.path.abspath(self.basedir))+"_"+key+".npy"
+
+	def load_field(self, key):
+		gname, shape, dtype = self.get_field_info(key)
+
+		if (self.cols is not None) and self.cols.has(key, dtype):
+			return self.cols.read(key, dtype)
+
+		if (self.cachedir != None):
+			cachename = self.get_cachename(key)
+			signature = np.asarray(hdf5lib.FileSignature(self.curfiles), dtype="int64")
+			arr = load_field_cache(cachename, shape, dtype, signature, self.verbose)
+			if (arr is not None):
+				return arr
+
+		if (self.counts is None):
+			self.counts, self.skips = read_all_counts(self.curfiles, self.nthreads)
+		if (self.verbose):
+			print("READSUBF: reading field :", key)
+		arr = np.empty(shape, dtype=dtype)
+		read_all_files(self.curfiles, [[gname, key, arr]], self.counts, self.skips, self.nthreads)
+
+		if (self.cachedir != None):
+			save_field_cache(cachename, arr, signature, self.verbose)
+		return arr
+
+
+#memory map of a cached field, or None if it is missing or was made from other chunk files
+def load_field_cache(cachename, shape, dtype, signature, verbose=False):
+	if (os.path.exists(cachename)==False):
+		return None
+	#signature first: it is written after the field, so a matching one never goes with an older field
+	try:
+		cached_signature = np.load(cachename+".sig.npy")
+		arr = np.load(cachename, mmap_mode="r")
+	except (OSError, ValueError):
+		return None
+	if (arr.shape != shape) | (arr.dtype != dtype) | (np.array_equal(cached_signature, signature)==False):
+		if (verbose):
+			print("READSUBF: ignoring stale field cache :", cachename)
+		return None
+	if (verbose):
+		print("READSUBF: mapped field cache :", cachename)
+	return arr
+
+def save_field_cache(cachename, arr, signature, verbose=False):
+	#write to private files first, so other ranks never map a partial field
+	for name, data in [(cachename, arr), (cachename+".sig.npy", signature)]:
+		try:
+			hdf5lib.WriteAtomic(name, lambda f: np.save(f, data))
+		except OSError:
+			if (verbose):
+				print("READSUBF: could not write field cache :", name)
+			return
+	if (verbose):
+		print("READSUBF: wrote field cache :", cachename)
+
+
+######################
+#CONSOLIDATED COLUMNS#
+######################
+#a catalog can be consolidated once into one column file per field (plain .npy, which is
+#memory mapped, or compressed .npz) plus a manifest.json with the dtype, shape and file of
+#every field and the sizes/modification times of the chunk files it was made from:
+#
+#python readsubfHDF5.py consolidate ./output/ 99 [--outdir DIR] [--compress]
+#
+#subfind_catalog and lazy_subfind_catalog then read fields from there while the manifest
+#matches the chunk files. Columns are stored in the dtype the catalogs return for the same
+#long_ids/double_output (by default float64 and uint32 ids), so reading them maps the file
+#without a copy, but never narrower than in the chunk files (64 bit ids stay uint64); a catalog
+#opened with other options converts the columns on loading. The manifest also records the dtype
+#of the chunk files, and a column that lost precision against them (caches of older versions)
+#is only used for exactly its own dtype, otherwise the field is read from the chunk files.
+
+#default location of the consolidated columns of a catalog
+def columns_dir(basedir, snapnum, name = "fof_subhalo_tab"):
+	return basedir + "/" + name + "_" + str(snapnum).zfill(3) + ".columns"
+
+class catalog_columns:
+	def __init__(self, dirname, manifest):
+		self.dirname = dirname
+		self.fields = manifest["fields"]
+
+	#whether the column holds the field with the given dtype as read from the chunk files
+	def has(self, key, dtype):
+		entry = self.fields.get(key)
+		if (entry is None):
+			return False
+		if (np.dtype(entry["dtype"]) == np.dtype(dtype)):
+			return True
+		return ("file_dtype" in entry) and np.can_cast(np.dtype(entry["file_dtype"]), np.dtype(entry["dtype"]))
+
+	#field (or rows of it) with the given dtype; uncompressed columns stored in that dtype are mapped, not read
+	def read(self, key, dtype, rows = None):
+		entry = self.fields[key]
+		filename = self.dirname + "/" + entry["file"]
+		if filename.endswith(".npz"):
+			with np.load(filename) as data:
+				arr = data["data"]
+		else:
+			arr = np.load(filename, mmap_mode="r")
+		if (rows is not None):
+			arr = arr[rows]
+		if (arr.dtype == np.dtype(dtype)):
+			return arr
+		return arr.astype(dtype)
+
+#column cache of a catalog if present and made from the current chunk files, else None
+def open_columns(columns, basedir, snapnum, name, curfiles, verbose = False):
+	if (columns is False):
+		return None
+	if (columns is None):
+		columns = columns_dir(basedir, snapnum, name)
+	manifestname = columns + "/manifest.json"
+	if (os.path.exists(manifestname) == False):
+		return None
+	try:
+		with open(manifestname) as f:
+			manifest = json.load(f)
+	except (OSError, ValueError):
+		return None
+	if (manifest.get("signature") != hdf5lib.FileSignature(curfiles)):
+		if (verbose):
+			print("READSUBF: ignoring stale column cache :", columns)
+		return None
+	if (verbose):
+		print("READSUBF: using column cache :", columns)
+	return catalog_columns(columns, manifest)
+
+#write every field (or the given keys) of a catalog to a column cache in outdir, in the dtypes
+#subfind_catalog returns for long_ids/double_output unless the chunk files store a wider one
+def consolidate(basedir, snapnum, name = "fof_subhalo_tab", outdir = None, compress = False, keys = None, long_ids = False, double_output = False, nthreads = None, verbose = False):
+	if (outdir == None):
+		outdir = columns_dir(basedir, snapnum, name)
+	if (nthreads == None):
+		nthreads = default_nthreads
+	filebase, curfile = catalog_files(basedir, snapnum, name)
+	dtypes = {"FLOAT":np.float32 if double_output else np.float64, "INT":np.int32, "INT64":np.int64, "ID":np.uint64 if long_ids else np.uint32}
+
+	#fields with their shape and dtype in the files and the dtype they are stored in
+	f=hdf5lib.OpenFile(curfile)
+	nfiles = hdf5lib.GetAttr(f, "Header", "NumFiles")
+	nrows = {"Group":int(hdf5lib.GetAttr(f, "Header", "Ngroups_Total")), "Subhalo":int(hdf5lib.GetAttr(f, "Header", "Nsubgroups_Total"))}
+	specs = []
+	for gname, datablocks in [["Group", grp_datablocks], ["Subhalo", sub_datablocks]]:
+		for key in datablocks:
+			if ((keys == None) or (key in keys)) and hdf5lib.Contains(f, gname, key):
+				data = hdf5lib.GetData(f, gname+"/"+key)
+				file_dtype = np.dtype(data.dtype)
+				dtype = np.dtype(dtypes[datablocks[key][0]])
+				specs.append([gname, key, (nrows[gname],)+tuple(data.shape[1:]), dtype if np.can_cast(file_dtype, dtype) else file_dtype, file_dtype])
+	f.close()
+
+	if (nfiles > 1):
+		curfiles = [filebase + str(filenum) + ".hdf5" for filenum in range(0, nfiles)]
+	else:
+		curfiles = [curfile]
+	counts, skips = read_all_counts(curfiles, nthreads)
+
+	os.makedirs(outdir, exist_ok=True)
+	fields = {}
+	for gname, key, shape, dtype, file_dtype in specs:
+		if (verbose):
+			print("READSUBF: consolidating field :", key, shape, dtype)
+		arr = np.empty(shape, dtype=dtype)
+		read_all_files(curfiles, [[gname, key, arr]], counts, skips, nthreads)
+
+		filename = key + (".npz" if compress else ".npy")
+		hdf5lib.WriteAtomic(outdir + "/" + filename, lambda out: np.savez_compressed(out, data=arr) if compress else np.save(out, arr))
+		fields[key] = {"group":gname, "dtype":dtype.str, "file_dtype":file_dtype.str, "shape":[int(n) for n in shape], "file":filename}
+		del arr
+
+	#the manifest is written last, so readers never see a partial cache
+	manifest = {"name":name, "snapnum":int(snapnum), "ngroups":nrows["Group"], "nsubs":nrows["Subhalo"], "signature":hdf5lib.FileSignature(curfiles), "fields":fields}
+	hdf5lib.WriteAtomic(outdir + "/manifest.json", lambda out: json.dump(manifest, out, indent=1), mode="w")
+	if (verbose):
+		print("READSUBF: wrote column cache :", outdir)
+	return outdir
+
+
+if __name__ == "__main__":
+	import argparse
+	parser = argparse.ArgumentParser(description="subfind catalog tools")
+	subparsers = parser.add_subparsers(dest="command", required=True)
+	parser_consolidate = subparsers.add_parser("consolidate", help="write a column cache of a catalog")
+	parser_consolidate.add_argument("basedir")
+	parser_consolidate.add_argument("snapnum", type=int)
+	parser_consolidate.add_argument("--name", default="fof_subhalo_tab")
+	parser_consolidate.add_argument("--outdir", default=None, help="default: <basedir>/<name>_<snapnum>.columns")
+	parser_consolidate.add_argument("--compress", action="store_true", help="compressed .npz columns (not memory mapped)")
+	parser_consolidate.add_argument("--keys", nargs="+", default=None, help="fields to consolidate (default: all)")
+	parser_consolidate.add_argument("--long-ids", action="store_true", help="store ids as uint64 (as with long_ids=True)")
+	parser_consolidate.add_argument("--double-output", action="store_true", help="store floats as float32 where the chunk files do (as with double_output=True)")
+	parser_consolidate.add_argument("--nthreads", type=int, default=None)
+	args = parser.parse_args()
+
+	if (args.command == "consolidate"):
+		consolidate(args.basedir, args.snapnum, name=args.name, outdir=args.outdir, compress=args.compress, keys=args.keys, long_ids=args.long_ids, double_output=args.double_output, nthreads=args.nthreads, verbose=True)
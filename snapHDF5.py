@@ -7,6 +7,24 @@
 # pos = snap.read_block("snap_063", "POS ", parttype=1) 
 # print pos
 #
+# chunk particle numbers and headers are read once per snapshot into snap.get_index("snap_063");
+# set snap.write_index = True to also keep them in snap_063.index.npz next to the snapshot;
+# rewritten chunk files are noticed within snap.index_check_interval seconds (0: on every read)
+#
+# particles picked by sorted index (e.g. matched ParticleIDs), nearby ones read together:
+# pos = snap.read_particles("snap_063", "POS ", 4, indices)
+#
+# the datasets of every particle type (dtype, shape, chunking, compression) are listed once per snapshot:
+# schema = snap.get_schema("snap_063"); schema.contains("RHO ", 0); schema.info("POS ", 1)
+#
+# with h5py, gzip compressed datasets can be decompressed on several threads while reading:
+# snap.decompress_threads = 8
+#
+# blocks can be written compressed and streamed in pieces (PyTables or h5py):
+# f = snap.openfile("snap_new.hdf5"); snap.writeheader(f, header)
+# snap.write_block(f, "POS ", 4, pos, compression="gzip", shuffle=True, append=True)
+# snap.write_block(f, "POS ", 4, more_pos, append=True); snap.closefile(f)
+#
 #
 # Mark Vogelsberger (mvogelsb@cfa.harvard.edu)
 
@@ -14,6 +32,8 @@ import numpy as np
 import os
 import sys
 import math
+import json
+import time
 import hdf5lib
 
 ############ 
@@ -211,6 +231,226 @@ class snapshot_header:
 
 
 
+#######################
+#SNAPSHOT LAYOUT INDEX#
+#######################
+#per-chunk particle numbers of a snapshot plus the header attributes the readers need, built
+#once (one header read per chunk file) and kept in memory while the chunk files are unchanged
+#(same sizes and modification times); with write=True (or write_index) it is also stored next to
+#the snapshot as <snapshot>.index.npz and reused on the same condition. A kept index is checked
+#against the chunk files at most every index_check_interval seconds, as that costs one stat per
+#chunk file; snapshots written through openfile() are noticed at once.
+write_index = False
+index_check_interval = 10.0
+snapshot_indices = {}
+
+#snapshot base name and chunk number of a snapshot or chunk file name (chunk None: whole multi-file snapshot)
+def split_filename(filename):
+	name = filename
+	if name.endswith(".hdf5"):
+		name = name[:-5]
+	head, sep, tail = name.rpartition(".")
+	if (sep == ".") and tail.isdigit() and os.path.exists(name+".hdf5") and os.path.exists(head+".0.hdf5"):
+		return head, int(tail)
+	if os.path.exists(name+".hdf5"):
+		return name, 0
+	if os.path.exists(name+".0.hdf5"):
+		return name, None
+	print("[error] file not found : ", filename)
+	sys.stdout.flush()
+	sys.exit()
+
+class snapshot_index:
+	attrs = ["nall", "nall_highword", "massarr", "time", "redshift", "boxsize", "filenum", "omega0", "omegaL", "hubble", "double"]
+
+	def __init__(self, base, write=False, verbose=False):
+		self.base = base
+		self.multiple = (os.path.exists(base+".hdf5") == False)
+		self.indexfile = base+".index.npz"
+
+		if (self.multiple):
+			head = snapshot_header(base+".0.hdf5")
+			self.filenames = [base+"."+str(num)+".hdf5" for num in range(0, int(head.filenum))]
+		else:
+			head = None
+			self.filenames = [base+".hdf5"]
+		signature = self.get_signature()
+
+		if (self.load(signature, verbose)):
+			return
+
+		if (head is None):
+			head = snapshot_header(self.filenames[0])
+		for attr in self.attrs:
+			vars(self)[attr] = getattr(head, attr)
+		self.npart = np.zeros([len(self.filenames), 6], dtype="int64")
+		for num, curfilename in enumerate(self.filenames):
+			if (verbose):
+				print("[index] reading header         : ", curfilename)
+				sys.stdout.flush()
+			f=hdf5lib.OpenFile(curfilename)
+			self.npart[num,:] = hdf5lib.GetAttr(f, "Header", "NumPart_ThisFile")
+			f.close()
+		self.signature = signature
+
+		if (write):
+			self.save(verbose)
+
+	#sizes and modification times of the chunk files
+	def get_signature(self):
+		return np.array(hdf5lib.FileSignature(self.filenames), dtype="int64").reshape(-1, 2)
+
+	def load(self, signature, verbose=False):
+		if (os.path.exists(self.indexfile) == False):
+			return False
+		try:
+			data = np.load(self.indexfile, allow_pickle=False)
+			if (np.array_equal(data["signature"], signature) == False):
+				if (verbose):
+					print("[index] stale index file       : ", self.indexfile)
+					sys.stdout.flush()
+				return False
+			self.signature = data["signature"]
+			self.npart = data["npart"]
+			for attr in self.attrs:
+				vars(self)[attr] = data[attr]
+		except (OSError, KeyError, ValueError):
+			return False
+		if (verbose):
+			print("[index] read index file        : ", self.indexfile)
+			sys.stdout.flush()
+		return True
+
+	def save(self, verbose=False):
+		try:
+			hdf5lib.WriteAtomic(self.indexfile, lambda f: np.savez(f, signature=self.signature, npart=self.npart, **dict([(attr, getattr(self, attr)) for attr in self.attrs])))
+		except OSError:
+			return
+		if (verbose):
+			print("[index] wrote index file       : ", self.indexfile)
+			sys.stdout.flush()
+
+#index of the snapshot a snapshot or chunk file name belongs to, and the chunk number (None: all chunks)
+def get_index(filename, write=None, verbose=False):
+	base, num = split_filename(filename)
+	key = os.path.abspath(base)
+	now = time.time()
+	if (key in snapshot_indices) and (now - snapshot_indices[key].checked >= index_check_interval):
+		#rebuild when a chunk file was rewritten (or removed) since the index was made
+		try:
+			unchanged = np.array_equal(snapshot_indices[key].get_signature(), snapshot_indices[key].signature)
+		except OSError:
+			unchanged = False
+		if (unchanged):
+			snapshot_indices[key].checked = now
+		else:
+			forget_index(filename)
+	if (key not in snapshot_indices):
+		if (write is None):
+			write = write_index
+		snapshot_indices[key] = snapshot_index(base, write, verbose)
+		snapshot_indices[key].checked = now
+	return snapshot_indices[key], num
+
+#forget the index and schema of the snapshot a file belongs to (the file need not exist yet)
+def forget_index(filename):
+	name = filename[:-5] if filename.endswith(".hdf5") else filename
+	head, sep, tail = name.rpartition(".")
+	for base in [name, head] if ((sep == ".") and tail.isdigit()) else [name]:
+		snapshot_indices.pop(os.path.abspath(base), None)
+		snapshot_schemas.pop(os.path.abspath(base), None)
+
+#forget all indices, e.g. after snapshot files were rewritten
+def clear_index():
+	snapshot_indices.clear()
+	snapshot_schemas.clear()
+
+
+######################
+#READ PLAN FOR A FILE#
+######################
+#list the pieces [kind, parttype, start, count] that make up block_name in an open file, in output order;
+#kind is "data" (read from the file), "mass" (replicated MassTable entry) or "fill" (zeros)
+def plan_single_file(f, npart, massarr, block_name, parttype=-1, no_mass_replicate=False, fill_block_name="", slab_start=-1, slab_len=-1):
+	pieces = []
+
+	#read specific particle type (parttype>=0, non-default)
+	if parttype>=0:
+		if (npart[parttype]==0):
+			return pieces
+		start = 0
+		count = int(npart[parttype])
+		if (slab_start!=-1) & (slab_len!=-1):
+			start = min(int(slab_start), count)
+			count = max(0, min(int(slab_len), count - start))
+		if ((block_name=="Masses") & (massarr[parttype]>0)):
+			pieces.append(["mass", parttype, start, count])
+		else:
+			pieces.append(["data", parttype, start, count])
+
+	#read all particle types (parttype=-1, default)
+	if parttype==-1:
+		for ptype in range(0,6):
+			part_name='PartType'+str(ptype)
+			if (hdf5lib.Contains(f,"",part_name)):
+				#replicate mass block per default (unless no_mass_replicate is set)
+				if ((block_name=="Masses") & (npart[ptype]>0) & (massarr[ptype]>0) & (no_mass_replicate==False)):
+					pieces.append(["mass", ptype, 0, int(npart[ptype])])
+				#fill fill_block_name with zeros if fill_block_name is set and particle type is present and fill_block_name not already stored in file for that particle type
+				if ((block_name==fill_block_name) & (block_name!="Masses") & (npart[ptype]>0) & (hdf5lib.Contains(f,part_name, block_name)==False)):
+					pieces.append(["fill", ptype, 0, int(npart[ptype])])
+				#default: just read the block
+				if (hdf5lib.Contains(f,part_name,block_name)):
+					pieces.append(["data", ptype, 0, int(hdf5lib.GetData(f, part_name+"/"+block_name).shape[0])])
+
+	return pieces
+
+#dtype and per-particle shape of the pieces; replicated/filled blocks follow the precision flag for parttype=-1
+def plan_dtype(f, pieces, block_name, dim2, parttype, doubleflag):
+	dtypes = []
+	shape = None
+	for kind, ptype, start, count in pieces:
+		if (kind=="data"):
+			data = hdf5lib.GetData(f, 'PartType'+str(ptype)+"/"+block_name)
+			dtypes.append(data.dtype)
+			if (shape is None):
+				shape = tuple(data.shape[1:])
+		elif (parttype==-1) & (doubleflag==0):
+			dtypes.append(np.dtype("float32"))
+		else:
+			dtypes.append(np.dtype("float64"))
+	if (shape is None):
+		shape = (dim2,) if ((dim2>1) & (len(pieces)>0) & (pieces[0][0]=="fill")) else ()
+	return dtypes, shape
+
+#threads that decompress the gzip chunks of a piece (0 or 1: decompressed by HDF5 on one thread)
+decompress_threads = 0
+
+#fill out (length = sum of piece counts) in place from an open file
+def read_pieces(f, pieces, massarr, block_name, out):
+	pos = 0
+	for kind, ptype, start, count in pieces:
+		if (count > 0):
+			if (kind=="data"):
+				hdf5lib.ReadDataThreaded(f, 'PartType'+str(ptype)+"/"+block_name, start, start+count, out[pos:pos+count], decompress_threads)
+			elif (kind=="mass"):
+				out[pos:pos+count] = massarr[ptype]
+			else:
+				out[pos:pos+count] = 0
+		pos += count
+	return out
+
+#zero-copy view of the pieces if they are a single slab of a contiguous, unfiltered dataset, else None
+def map_pieces(f, pieces, block_name):
+	if (len(pieces)!=1) or (pieces[0][0]!="data"):
+		return None
+	kind, ptype, start, count = pieces[0]
+	datamap = hdf5lib.GetDataMap(f, 'PartType'+str(ptype)+"/"+block_name)
+	if (datamap is None):
+		return None
+	return datamap[start:start+count]
+
+
 ##############################
 #READ ROUTINE FOR SINGLE FILE#
 ############################## 
@@ -221,139 +461,144 @@ def read_block_single_file(filename, block_name, dim2, parttype=-1, no_mass_repl
 		print("[single] reading                : ", block_name)
 		sys.stdout.flush()
 
-	head = snapshot_header(filename)
-	npart = head.npart
-	massarr = head.massarr
-	nall = head.nall
-	filenum = head.filenum
-	doubleflag = head.double #GADGET-2 change
+	index, num = get_index(filename)
+	if (num is None):
+		num = 0
+	filename = index.filenames[num]
+	npart = index.npart[num]
+	massarr = index.massarr
+	doubleflag = index.double #GADGET-2 change
 	#doubleflag = 0          #GADGET-2 change
 
-
 	if (parttype!=-1):
-		if (head.npart[parttype]==0):
+		if (npart[parttype]==0):
 			return [0, False]
 	else:
-		if (head.npart.sum()==0):
+		if (npart.sum()==0):
 			return [0, False]
-	del head
 
+	f=hdf5lib.OpenFile(filename)
 
-	#construct indices for partial access
-	if (slab_start!=-1) & (slab_len!=-1):
-		data_slice = slice(slab_start, (slab_start+slab_len))
-	else:
-		data_slice = slice(None, None, 1)
+	pieces = plan_single_file(f, npart, massarr, block_name, parttype, no_mass_replicate, fill_block_name, slab_start, slab_len)
+	dtypes, shape = plan_dtype(f, pieces, block_name, dim2, parttype, doubleflag)
+	if (verbose):
+		print("[single] pieces                 : ", pieces)
+		sys.stdout.flush()
+
+	if (len(pieces)==0):
+		f.close()
+		return [0, False]
+
+	#allocate once and fill in place
+	ret_val = np.empty((sum([p[3] for p in pieces]),)+shape, dtype=np.result_type(*dtypes))
+	read_pieces(f, pieces, massarr, block_name, ret_val)
 
 	if (verbose):
-		print("[single] data slice: ", data_slice)
-		sys.stdout.flush() 
+		print("[single] read particles (total) : ", ret_val.shape[0])
+		sys.stdout.flush()
 
-	f=hdf5lib.OpenFile(filename)
+	f.close()
 
+	return [ret_val, True]
 
-	#read specific particle type (parttype>=0, non-default)
-	if parttype>=0:
-		if (verbose):
-			print("[single] parttype               : ", parttype) 
-			sys.stdout.flush()
-		if ((block_name=="Masses") & (npart[parttype]>0) & (massarr[parttype]>0)):
-			if (verbose):
-				print("[single] replicate mass block")
-				sys.stdout.flush()	
-			ret_val=np.repeat(massarr[parttype], npart[parttype])[data_slice]
-		else:		
-			part_name='PartType'+str(parttype)
-			ret_val = hdf5lib.GetData(f, part_name+"/"+block_name)[data_slice]
-		if (verbose):
-			print("[single] read particles (total) : ", ret_val.shape[0]/dim2)
-			sys.stdout.flush()
+########################################
+#READ SEVERAL BLOCKS FROM A SINGLE FILE#
+########################################
+#opens the file once and reads all blocks (tags as in datablocks) over the same slab;
+#if out is given ({block: array} with room for the slab) the data is read into it in place,
+#otherwise new arrays are allocated (of type dtype if given, converted while reading);
+#with mmap, blocks stored contiguous and unfiltered are returned as read-only memmap views instead
+def read_blocks_single_file(filename, blocks, parttype, slab_start=-1, slab_len=-1, verbose=False, out=None, dtype=None, mmap=False):
+	if parttype not in [0,1,2,3,4,5]:
+		print("[error] wrong parttype given")
+		sys.stdout.flush()
+		sys.exit()
 
-	#read all particle types (parttype=-1, default)
-	if parttype==-1:
-		first=True
-		dim1=int(0)
-		for parttype in range(0,6):
-			part_name='PartType'+str(parttype)
-			if (hdf5lib.Contains(f,"",part_name)):
-				if (verbose):
-					print("[single] parttype               : ", parttype)
-					print("[single] massarr                : ", massarr)
-					print("[single] npart                  : ", npart)
-					sys.stdout.flush()
+	for block in blocks:
+		if (block not in datablocks):
+			print("[error] Block type ", block, "not known!")
+			sys.stdout.flush()
+			sys.exit()
 
-				#replicate mass block per default (unless no_mass_replicate is set)
-				if ((block_name=="Masses") & (npart[parttype]>0) & (massarr[parttype]>0) & (no_mass_replicate==False)):
-					if (verbose):
-						print("[single] replicate mass block")
-						sys.stdout.flush()
-					if (first):
-						data=np.repeat(massarr[parttype], npart[parttype])
-						dim1+=int(data.shape[0])
-						ret_val=data
-						first=False
-					else:	
-						data=np.repeat(massarr[parttype], npart[parttype])
-						dim1+=int(data.shape[0])
-						ret_val=np.append(ret_val, data)
-					if (verbose):
-						print("[single] read particles (total) : ", ret_val.shape[0]/dim2)
-						sys.stdout.flush()
-					if (doubleflag==0):
-						ret_val=ret_val.astype("float32")
+	index, num = get_index(filename)
+	if (num is None):
+		num = 0
+	filename = index.filenames[num]
+	npart = index.npart[num]
+	massarr = index.massarr
 
+	if (verbose):
+		print("[multi] reading file            : ", filename)
+		print("[multi] reading                 : ", blocks)
+		sys.stdout.flush()
 
-				#fill fill_block_name with zeros if fill_block_name is set and particle type is present and fill_block_name not already stored in file for that particle type
-				if ((block_name==fill_block_name) & (block_name!="Masses") & (npart[parttype]>0) & (hdf5lib.Contains(f,part_name, block_name)==False)):
-					if (verbose):
-						print("[single] replicate block name", fill_block_name)
-						sys.stdout.flush()
-					if (first):
-						data=np.repeat(0.0, npart[parttype]*dim2)
-						dim1+=int(data.shape[0])
-						ret_val=data
-						first=False
-					else:
-						data=np.repeat(0.0, npart[parttype]*dim2)
-						dim1+=int(data.shape[0])
-						ret_val=np.append(ret_val, data)
-					if (verbose):
-						print("[single] read particles (total) : ", ret_val.shape[0]/dim2)
-						sys.stdout.flush()
-					if (doubleflag==0):
-						ret_val=ret_val.astype("float32")
+	f=hdf5lib.OpenFile(filename)
 
-				#default: just read the block
-				if (hdf5lib.Contains(f,part_name,block_name)):
-					if (first):
-						data=hdf5lib.GetData(f, part_name+"/"+block_name)[:]
-						dim1+=int(data.shape[0])
-						ret_val=data
-						first=False
-					else:
-						data=hdf5lib.GetData(f, part_name+"/"+block_name)[:]
-						dim1+=int(data.shape[0])
-						ret_val=np.append(ret_val, data)
-					if (verbose):
-						print("[single] read particles (total) : ", ret_val.shape[0]/dim2)
-						sys.stdout.flush()
-
-		if ((dim1>0) & (dim2>1)):
-			ret_val=ret_val.reshape(dim1,dim2)
-			if (verbose):
-				print("[single] reshape done: ", ret_val.shape)
-				sys.stdout.flush()
+	ret_val = {}
+	for block in blocks:
+		block_name = datablocks[block][0]
+		pieces = plan_single_file(f, npart, massarr, block_name, parttype, slab_start=slab_start, slab_len=slab_len)
+		if (out is not None):
+			ret_val[block] = out[block]
+		else:
+			if (mmap) & (dtype is None):
+				ret_val[block] = map_pieces(f, pieces, block_name)
+				if (ret_val[block] is not None):
+					continue
+			dtypes, shape = plan_dtype(f, pieces, block_name, datablocks[block][1], parttype, 1)
+			block_dtype = dtype if (dtype is not None) else np.result_type(*dtypes)
+			ret_val[block] = np.empty((sum([p[3] for p in pieces]),)+shape, dtype=block_dtype)
+		read_pieces(f, pieces, massarr, block_name, ret_val[block])
+	f.close()
 
+	return ret_val
 
+#dtype and per-particle shape of each block (tags as in datablocks) of one particle type in a file,
+#so that callers can allocate their output before reading: {block: [dtype, shape]}
+def read_blocks_layout(filename, blocks, parttype):
+	index, num = get_index(filename)
+	if (num is None):
+		num = 0
+	npart = index.npart[num]
+	massarr = index.massarr
+
+	f=hdf5lib.OpenFile(index.filenames[num])
+
+	ret_val = {}
+	for block in blocks:
+		block_name = datablocks[block][0]
+		pieces = plan_single_file(f, npart, massarr, block_name, parttype)
+		dtypes, shape = plan_dtype(f, pieces, block_name, datablocks[block][1], parttype, 1)
+		if (len(dtypes)==0):
+			dtypes = [np.dtype("float64")]
+		ret_val[block] = [np.result_type(*dtypes), shape]
 	f.close()
 
+	return ret_val
 
-	return [ret_val, True]
+#output array for n rows of shape/dtype: a new array, or the first rows of a caller supplied buffer
+def output_buffer(out, shape, dtype):
+	if (out is None):
+		return np.empty(shape, dtype=dtype)
+	if (out.shape[0] < shape[0]) | (tuple(out.shape[1:]) != tuple(shape[1:])):
+		print("[error] output buffer of shape ", out.shape, " too small for ", shape)
+		sys.stdout.flush()
+		sys.exit()
+	return out[:shape[0]]
 
 ##############
 #READ ROUTINE#
 ##############
-def read_block(filename, block, parttype=-1, no_mass_replicate=False, fill_block="", slab_start=-1, slab_len=-1, verbose=False):
+#with out (an array with at least as many rows as particles read) the data is read into
+#out and the leading rows of out are returned; dtype converts the data while reading.
+#With mmap, a block that comes from a single contiguous, unfiltered dataset (e.g. one
+#particle type of a single-file snapshot or of one chunk file) is returned as a read-only
+#np.memmap view without copying, so only the pages that are touched are read; anything
+#else (chunked/compressed data, several files or types, replicated masses) is read as usual.
+#With mass_view, masses that all come from one MassTable entry (e.g. MASS of PartType1) are
+#returned as a read-only broadcast view of that single value instead of an allocated array;
+#sums, means and masks work on it as on the full array
+def read_block(filename, block, parttype=-1, no_mass_replicate=False, fill_block="", slab_start=-1, slab_len=-1, verbose=False, out=None, dtype=None, mmap=False, mass_view=False):
 	if (verbose):
 		print("reading block          : ", block)
 		sys.stdout.flush()	
@@ -363,17 +608,14 @@ def read_block(filename, block, parttype=-1, no_mass_replicate=False, fill_block
 		sys.stdout.flush()
 		sys.exit()
 
-	curfilename=filename+".hdf5"
-
-	if os.path.exists(curfilename):
-		multiple_files=False
-	elif os.path.exists(filename+".0"+".hdf5"):
-		curfilename = filename+".0"+".hdf5"
+	#chunk layout and headers come from the snapshot index; a chunk file name reads just that chunk
+	index, num = get_index(filename)
+	if (num is None):
+		fnrs = range(0, len(index.filenames))
 		multiple_files=True
 	else:
-		print("[error] file not found : ", filename)
-		sys.stdout.flush()
-		sys.exit()
+		fnrs = [num]
+		multiple_files=False
 
 	slabflag=False
 	if ((slab_start!=-1) | (slab_len!=-1)):
@@ -383,15 +625,9 @@ def read_block(filename, block, parttype=-1, no_mass_replicate=False, fill_block
 			sys.stdout.flush()
 			sys.exit()
 
-	head = snapshot_header(curfilename)
-	filenum = head.filenum
-	del head
-
-
 	if (block in datablocks):
 		block_name=datablocks[block][0]
 		dim2=datablocks[block][1]
-		first=True
 		if (verbose):
 			print("Reading HDF5           : ", block_name)
 			print("Data dimension         : ", dim2)
@@ -412,149 +648,298 @@ def read_block(filename, block, parttype=-1, no_mass_replicate=False, fill_block
 				print("Block filling active   : ", fill_block_name)
 				sys.stdout.flush()
 
-	if (multiple_files):	
-		if (slabflag==False):
-			first=True
-			dim1=int(0)
-			for num in range(0,filenum):
-				curfilename=filename+"."+str(num)+".hdf5"
-				if (verbose):
-					print("Reading file           : ", num, curfilename)
-					sys.stdout.flush() 
-				if (first):
-					data, succ = read_block_single_file(curfilename, block_name, dim2, parttype, no_mass_replicate, fill_block_name, slab_start, slab_len, verbose)
-					if (succ == True):
-						dim1+=int(data.shape[0])
-						ret_val = data
-						first = False 
-				else:	 
-					data, succ = read_block_single_file(curfilename, block_name, dim2, parttype, no_mass_replicate, fill_block_name, slab_start, slab_len, verbose)
-					if (succ == True):
-						dim1+=int(data.shape[0])
-						ret_val=np.append(ret_val, data)
-				if (verbose):
-					if (succ):
-						print("Read particles (total) : ", ret_val.shape[0]/dim2)
-						sys.stdout.flush()
-					else:
-						print("Read particles (total) : none")
-						sys.stdout.flush()
-
-
-		if (slabflag==True):
-			off=slab_start
-			left=slab_len
-			first=True
-			dim1=int(0)
-			for num in range(0,filenum):
-				curfilename=filename+"."+str(num)+".hdf5"
-				head = snapshot_header(curfilename)
-				nloc=head.npart[parttype]
-				if (nloc > off):
-					start = off
-					if (nloc - off > left):
-						count = left
-					else:
-						count = nloc - off
-					if (verbose):
-						print("Reading file           : ", num, curfilename, start, count)
-						sys.stdout.flush()
-					if (first):
-						data, succ = read_block_single_file(curfilename, block_name, dim2, parttype, no_mass_replicate, fill_block_name, slab_start=start, slab_len=count, verbose=verbose)
-						if (succ == True):
-							dim1+=data.shape[0]
-							ret_val = data
-							first = False
-					else:
-						data, succ = read_block_single_file(curfilename, block_name, dim2, parttype, no_mass_replicate, fill_block_name, slab_start=start, slab_len=count, verbose=verbose)
-						if (succ == True):
-							dim1+=data.shape[0]
-							ret_val=np.append(ret_val, data)
-					if (verbose):
-						if (succ):
-							print("Read particles (total) : ", ret_val.shape[0]/dim2)
-							sys.stdout.flush()
-						else:
-							print("Read particles (total) : none")
-							sys.stdout.flush()
-
-					left -= count
-					off += count
+	#first pass: work out the pieces of every file from the headers, and the total length and dtype
+	plans = []
+	dtypes = []
+	shape = None
+	off=slab_start
+	left=slab_len
+	for num in fnrs:
+		curfilename = index.filenames[num]
+		npart = index.npart[num]
+		if (parttype!=-1):
+			nloc = npart[parttype]
+		else:
+			nloc = npart.sum()
+		if (nloc == 0):
+			continue
+
+		start=slab_start
+		count=slab_len
+		if (slabflag==True) & (multiple_files==True):
+			if (nloc <= off):
+				off -= nloc
 				if (left==0):
 					break
-				off -= nloc
-
-
-
+				continue
+			start = off
+			if (nloc - off > left):
+				count = left
+			else:
+				count = nloc - off
+			left -= count
+			off = 0
+
+		f=hdf5lib.OpenFile(curfilename)
+		pieces = plan_single_file(f, npart, index.massarr, block_name, parttype, no_mass_replicate, fill_block_name, start, count)
+		file_dtypes, file_shape = plan_dtype(f, pieces, block_name, dim2, parttype, index.double)
+		f.close()
+		if (len(pieces)==0):
+			continue
+		if (shape is None):
+			shape = file_shape
+		dtypes += file_dtypes
+		plans.append([curfilename, pieces, index.massarr])
 		if (verbose):
-			print("all partial files read in")
+			print("Planned file           : ", curfilename, pieces)
 			sys.stdout.flush()
+		if (slabflag==True) & (multiple_files==True) & (left==0):
+			break
 
-		if ((dim1>0) & (dim2>1)):
-			ret_val=ret_val.reshape(dim1,dim2)
+	if (len(plans)==0):
+		if (verbose):
+			print("Read particles (total) : none")
+			sys.stdout.flush()
+		return 0
+
+	#a single slab of a contiguous dataset can be mapped instead of read
+	if (mmap) & (out is None) & (dtype is None) & (len(plans)==1):
+		f=hdf5lib.OpenFile(plans[0][0])
+		ret_val = map_pieces(f, plans[0][1], block_name)
+		f.close()
+		if (ret_val is not None):
+			if (verbose):
+				print("Mapped particles       : ", ret_val.shape[0])
+				sys.stdout.flush()
+			return ret_val
+
+	#second pass: allocate the output once (or use the caller's buffer) and read every file into its own slice
+	dim1 = sum([sum([p[3] for p in pieces]) for curfilename, pieces, massarr in plans])
+	if (dtype is None):
+		dtype = np.result_type(*dtypes)
+
+	#a single replicated MassTable entry needs no storage at all
+	if (mass_view) & (out is None):
+		kinds = set([(p[0], p[1]) for curfilename, pieces, massarr in plans for p in pieces])
+		if (len(kinds)==1) and (list(kinds)[0][0]=="mass"):
+			ret_val = np.broadcast_to(np.asarray(index.massarr[list(kinds)[0][1]], dtype=dtype), (dim1,))
 			if (verbose):
-				print("Reshape done (total): ", ret_val.shape)
+				print("Constant mass          : ", ret_val[0] if dim1 > 0 else None, dim1)
 				sys.stdout.flush()
+			return ret_val
+	ret_val = output_buffer(out, (dim1,)+shape, dtype)
+	pos = 0
+	for curfilename, pieces, massarr in plans:
+		nloc = sum([p[3] for p in pieces])
+		if (verbose):
+			print("Reading file           : ", curfilename, pos, nloc)
+			sys.stdout.flush()
+		f=hdf5lib.OpenFile(curfilename)
+		read_pieces(f, pieces, massarr, block_name, ret_val[pos:pos+nloc])
+		f.close()
+		pos += nloc
+
+	if (verbose):
+		print("Read particles (total) : ", ret_val.shape[0])
+		sys.stdout.flush()
 
+	return ret_val
 
-	else:	
-		ret_val, succ = read_block_single_file(curfilename, block_name, dim2, parttype, no_mass_replicate, fill_block_name, slab_start, slab_len, verbose)
+
+#########################
+#READ PARTICLES BY INDEX#
+#########################
+#rows indices (sorted, global over all chunk files of the snapshot or within a chunk file) of block
+#for one particle type, in the order given. The indices are split at chunk file boundaries and
+#wherever two are more than max_gap apart; every run is read as one slab and the wanted rows are
+#picked from it, so nearby particles cost one read. out/dtype as in read_block.
+def read_particles(filename, block, parttype, indices, max_gap=1024, verbose=False, out=None, dtype=None):
+	if parttype not in [0,1,2,3,4,5]:
+		print("[error] wrong parttype given")
+		sys.stdout.flush()
+		sys.exit()
+
+	if (block not in datablocks):
+		print("[error] Block type ", block, "not known!")
+		sys.stdout.flush()
+		sys.exit()
+	block_name = datablocks[block][0]
+
+	indices = np.asarray(indices, dtype="int64")
+	if (len(indices) > 0) and ((np.any(np.diff(indices) < 0)) | (indices[0] < 0)):
+		print("[error] particle indices must be sorted and non-negative")
+		sys.stdout.flush()
+		sys.exit()
+
+	index, num = get_index(filename)
+	fnrs = range(0, len(index.filenames)) if (num is None) else [num]
+	nfile = np.array([index.npart[num][parttype] for num in fnrs], dtype="int64")
+	file_start = np.zeros(len(nfile) + 1, dtype="int64")
+	np.cumsum(nfile, out=file_start[1:])
+	if (len(indices) > 0) and (indices[-1] >= file_start[-1]):
+		print("[error] particle index ", indices[-1], " out of range (", file_start[-1], " particles)")
+		sys.stdout.flush()
+		sys.exit()
+
+	#dtype and shape from the first file that has this particle type
+	if (file_start[-1] == 0):
+		return 0
+	first = fnrs[np.nonzero(nfile)[0][0]]
+	f=hdf5lib.OpenFile(index.filenames[first])
+	pieces = plan_single_file(f, index.npart[first], index.massarr, block_name, parttype)
+	dtypes, shape = plan_dtype(f, pieces, block_name, datablocks[block][1], parttype, index.double)
+	f.close()
+	if (len(pieces)==0):
+		return 0
+	if (dtype is None):
+		dtype = np.result_type(*dtypes)
+	ret_val = output_buffer(out, (len(indices),)+shape, dtype)
+
+	#runs of indices within one file and at most max_gap apart
+	filenr = np.searchsorted(file_start, indices, side="right") - 1
+	breaks = np.nonzero((np.diff(indices) > max_gap) | (np.diff(filenr) != 0))[0] + 1
+	run_start = np.concatenate([[0], breaks]).astype("int64")
+	run_stop = np.concatenate([breaks, [len(indices)]]).astype("int64")
+	run_stop = run_stop[run_start < len(indices)]
+	run_start = run_start[run_start < len(indices)]
+	if (verbose):
+		print("Particles / read runs  : ", len(indices), len(run_start))
+		sys.stdout.flush()
+
+	buf = None
+	for i in range(0, len(run_start)):
+		lo = run_start[i]
+		hi = run_stop[i]
+		num = fnrs[filenr[lo]]
+		slab_start = indices[lo] - file_start[filenr[lo]]
+		slab_len = indices[hi-1] - indices[lo] + 1
+		if (buf is None) or (buf.shape[0] < slab_len):
+			buf = np.empty((slab_len,)+shape, dtype=dtype)
+		f=hdf5lib.OpenFile(index.filenames[num])
+		pieces = plan_single_file(f, index.npart[num], index.massarr, block_name, parttype, slab_start=slab_start, slab_len=slab_len)
+		read_pieces(f, pieces, index.massarr, block_name, buf[:slab_len])
+		f.close()
+		ret_val[lo:hi] = buf[indices[lo:hi] - indices[lo]]
 
 	return ret_val
 
+#################
+#SNAPSHOT SCHEMA#
+#################
+#which datasets each particle type has, with their dtype, per-particle shape, chunk shape and compression,
+#found once per snapshot (from the first chunk file that holds particles of each type) and kept in memory;
+#with write (default write_index) also stored as <snapshot>.schema.json, reused while the chunk files are unchanged
+snapshot_schemas = {}
+
+class snapshot_schema:
+	def __init__(self, index, write=False, verbose=False):
+		self.schemafile = index.base+".schema.json"
+		if (self.load(index.signature, verbose)):
+			return
+
+		#fields[parttype][hdf5 name] = {"dtype", "shape" (per particle), "chunks", "compression", "shuffle"}
+		self.fields = [{} for parttype in range(0,6)]
+		for parttype in range(0,6):
+			nums = np.nonzero(index.npart[:,parttype] > 0)[0]
+			if (len(nums) == 0):
+				continue
+			if (verbose):
+				print("[schema] reading types of      : ", index.filenames[nums[0]], parttype)
+				sys.stdout.flush()
+			f=hdf5lib.OpenFile(index.filenames[nums[0]])
+			part_name='PartType'+str(parttype)
+			if (hdf5lib.Contains(f,"",part_name)):
+				for name in hdf5lib.ListGroup(f, part_name):
+					info = hdf5lib.GetDataInfo(f, part_name+"/"+name)
+					info["shape"] = info["shape"][1:]
+					self.fields[parttype][name] = info
+			f.close()
+		self.signature = index.signature
+
+		if (write):
+			self.save(verbose)
+
+	def load(self, signature, verbose=False):
+		if (os.path.exists(self.schemafile) == False):
+			return False
+		try:
+			with open(self.schemafile) as f:
+				data = json.load(f)
+			if (np.array_equal(np.array(data["signature"], dtype="int64"), signature) == False):
+				if (verbose):
+					print("[schema] stale schema file     : ", self.schemafile)
+					sys.stdout.flush()
+				return False
+			self.signature = signature
+			self.fields = data["fields"]
+		except (OSError, KeyError, ValueError):
+			return False
+		if (verbose):
+			print("[schema] read schema file      : ", self.schemafile)
+			sys.stdout.flush()
+		return True
+
+	def save(self, verbose=False):
+		try:
+			hdf5lib.WriteAtomic(self.schemafile, lambda f: json.dump({"signature": self.signature.tolist(), "fields": self.fields}, f, indent=1), mode="w")
+		except OSError:
+			return
+		if (verbose):
+			print("[schema] wrote schema file     : ", self.schemafile)
+			sys.stdout.flush()
+
+	#block tags (as in datablocks) stored for a particle type
+	def blocks(self, parttype):
+		return [tag for tag in datablocks if datablocks[tag][0] in self.fields[parttype]]
+
+	#storage info of a block tag or hdf5 name for a particle type, None if it is not stored
+	def info(self, block, parttype):
+		name = datablocks[block][0] if (block in datablocks) else block
+		return self.fields[parttype].get(name)
+
+	def contains(self, block, parttype):
+		return self.info(block, parttype) is not None
+
+#schema of the snapshot a snapshot or chunk file name belongs to
+def get_schema(filename, write=None, verbose=False):
+	index, num = get_index(filename, write, verbose)
+	key = os.path.abspath(index.base)
+	if (key not in snapshot_schemas) or (np.array_equal(snapshot_schemas[key].signature, index.signature) == False):
+		if (write is None):
+			write = write_index
+		snapshot_schemas[key] = snapshot_schema(index, write, verbose)
+	return snapshot_schemas[key]
+
 
 #############
 #LIST BLOCKS#
 #############
+#prints the blocks of each particle type (or only of parttype) and returns them as {parttype: [tags]}
 def list_blocks(filename, parttype=-1, verbose=False):
-
-	f=hdf5lib.OpenFile(filename)
-	for parttype in range(0,6):
-		part_name='PartType'+str(parttype)
-		if (hdf5lib.Contains(f,"",part_name_)):
-			print("Parttype contains : ", parttype)
-			print("-------------------")
-			sys.stdout.flush()
-			iter = it=datablocks.__iter__()
-			next = next(iter)
-			while (1):
-				if (verbose):
-					print("check ", next, datablocks[next][0])
-					sys.stdout.flush()
-				if (hdf5lib.Contains(f,part_name,datablocks[next][0])):
-					print(next, datablocks[next][0])
-					sys.stdout.flush()
-				try:
-					next=next(iter)
-				except StopIteration:
-					break	
-	f.close() 
+	schema = get_schema(filename, verbose=verbose)
+	ret_val = {}
+	for ptype in (range(0,6) if (parttype==-1) else [parttype]):
+		if (len(schema.fields[ptype]) == 0):
+			continue
+		print("Parttype contains : ", ptype)
+		print("-------------------")
+		ret_val[ptype] = schema.blocks(ptype)
+		for tag in ret_val[ptype]:
+			print(tag, datablocks[tag][0])
+		sys.stdout.flush()
+	return ret_val
 
 #################
 #CONTAINS BLOCKS#
 #################
+#True if a block whose tag contains tag is stored for parttype (any type for parttype=-1)
 def contains_block(filename, tag, parttype=-1, verbose=False):
-
-	contains_flag=False
-	f=hdf5lib.OpenFile(filename)
-	for parttype in range(0,6):
-		part_name='PartType'+str(parttype)
-		if (hdf5lib.Contains(f,"",part_name)):
-			iter = it=datablocks.__iter__()
-			next = next(iter)
-			while (1):
-				if (verbose):
-					print("check ", next, datablocks[next][0])
-					sys.stdout.flush()
-				if (hdf5lib.Contains(f,part_name,datablocks[next][0])):
-					if (next.find(tag)>-1):
-						contains_flag=True	
-				try:
-					next=next(iter)
-				except StopIteration:
-					break
-	f.close() 
-	return contains_flag
+	schema = get_schema(filename, verbose=verbose)
+	for ptype in (range(0,6) if (parttype==-1) else [parttype]):
+		for block in schema.blocks(ptype):
+			if (block.find(tag)>-1):
+				return True
+	return False
 
 ############
 #CHECK FILE#
@@ -578,6 +963,8 @@ def check_file(filename):
 #OPEN FILE FOR WRITING#
 #######################
 def openfile(filename, mode="w"):
+	if (mode != "r"):
+		forget_index(filename)
 	f=hdf5lib.OpenFile(filename, mode = mode)	 
 	return f
 
@@ -613,7 +1000,11 @@ def writeheader(f, header):
 ###############
 #WRITE ROUTINE#
 ###############
-def write_block(f, block, parttype, data):
+#chunks, compression ("gzip", or "lzf" with h5py), compression_opts and shuffle set the storage of a new block;
+#with append the block is created extendable and later calls append their rows to it; the header
+#NumPart_ThisFile of the particle type is then set to the rows written so far and NumPart_Total
+#(with its high word) changed by the same amount, so writeheader() must come first
+def write_block(f, block, parttype, data, chunks=None, compression=None, compression_opts=None, shuffle=False, append=False):
 	part_name="PartType"+str(parttype)
 	if (hdf5lib.Contains(f, "", part_name)==False):
 		group=hdf5lib.CreateGroup(f, part_name)
@@ -624,14 +1015,42 @@ def write_block(f, block, parttype, data):
 		block_name=datablocks[block][0]
 		dim2=datablocks[block][1]		
 		if (hdf5lib.ContainsGroup(group, block_name)==False):
-			hdf5lib.CreateArray(f, group, block_name, data)
+			hdf5lib.CreateArray(f, group, block_name, data, chunks=chunks, compression=compression, compression_opts=compression_opts, shuffle=shuffle, extendable=append)
+		elif (append):
+			hdf5lib.AppendArray(f, group, block_name, data)
 		else:
 			print("I/O block already written")
 			sys.stdout.flush()
+			return
+		if (append):
+			update_numpart(f, parttype, hdf5lib.GetDataInfo(f, part_name+"/"+block_name)["shape"][0])
 	else:
 		print("Unknown I/O block")
 		sys.stdout.flush()		
 
+#####################
+#HEADER AFTER APPEND#
+#####################
+#set NumPart_ThisFile of a particle type to npart and move NumPart_Total (and high word) along
+def update_numpart(f, parttype, npart):
+	if (hdf5lib.Contains(f, "", "Header")==False):
+		print("[error] write the header before appending to a block")
+		sys.stdout.flush()
+		sys.exit()
+	group_header=hdf5lib.GetGroup(f, "Header")
+	npart_file = np.array(hdf5lib.GetAttr(f, "Header", "NumPart_ThisFile"))
+	nall = np.array(hdf5lib.GetAttr(f, "Header", "NumPart_Total"))
+	nall_highword = np.array(hdf5lib.GetAttr(f, "Header", "NumPart_Total_HighWord"))
+	total = int(nall[parttype]) + (int(nall_highword[parttype]) << 32) + npart - int(npart_file[parttype])
+	npart_file[parttype] = npart
+	nall[parttype] = total & 0xffffffff
+	nall_highword[parttype] = total >> 32
+	hdf5lib.SetAttr(group_header, "NumPart_ThisFile", npart_file)
+	hdf5lib.SetAttr(group_header, "NumPart_Total", nall)
+	hdf5lib.SetAttr(group_header, "NumPart_Total_HighWord", nall_highword)
+	forget_index(f.filename)
+
+
 
 
 
@@ -81,7 +81,14 @@ good_ids = np.where(my_subs > -1)[0]
 
 regions = {'inner': lambda r: r < 2.0 * u.kpc}
 
-for sub_id in my_subs[good_ids]:
+if args.local:
+    reader = readhaloHDF5.SnapshotHaloReader(args.local, snapnum, long_ids=True,
+                                             double_output=False)
+
+    star_sweep = reader.iter_subhalos(4, my_subs[good_ids], ["POS ", "GAGE", "GIMA", "GZ  "],
+                                      out={}, dtype="float32")
+
+for sub_id in np.sort(my_subs[good_ids]):
 
     sub_ind = np.where(sub_list == sub_id)[0] # array
 
@@ -115,23 +122,14 @@ for sub_id in my_subs[good_ids]:
 
     # Otherwise get this information from the local snapshot
     else:
-        readhaloHDF5.reset()
-
-        coords = readhaloHDF5.readhalo(args.local, "snap", snapnum, 
-                                       "POS ", 4, -1, sub_id, long_ids=True,
-                                       double_output=False).astype("float32") 
-
-        a = readhaloHDF5.readhalo(args.local, "snap", snapnum,
-                                  "GAGE", 4, -1, sub_id, long_ids=True,
-                                  double_output=False).astype("float32")
-
-        init_mass = readhaloHDF5.readhalo(args.local, "snap", snapnum,
-                                          "GIMA", 4, -1, sub_id, long_ids=True, 
-                                          double_output=False).astype("float32")
-
-        metals = readhaloHDF5.readhalo(args.local, "snap", snapnum,
-                                       "GZ  ", 4, -1, sub_id, long_ids=True,
-                                       double_output=False).astype("float32") 
+        star_data = readhaloHDF5.next_subhalo(star_sweep, sub_id)
+        if star_data is None:
+            print("No PartType4 for subhalo", sub_id)
+            continue
+        coords = star_data["POS "]
+        a = star_data["GAGE"]
+        init_mass = star_data["GIMA"]
+        metals = star_data["GZ  "]
 
     stars = a > 0
 
@@ -0,0 +1,91 @@
+import os
+import sys
+import types
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import hdf5lib
+import snapHDF5
+
+SNAPNUM = 99
+PARTTYPES = [0, 1, 4]
+ID_OFFSET = 2**33
+
+
+def write_file(filename, header, groups):
+    f = hdf5lib.OpenFile(filename, mode="w")
+    group_header = hdf5lib.CreateGroup(f, "Header")
+    for name in header:
+        hdf5lib.SetAttr(group_header, name, header[name])
+    for gname in groups:
+        group = hdf5lib.CreateGroup(f, gname)
+        for name in groups[gname]:
+            hdf5lib.CreateArray(f, group, name, groups[gname][name])
+    f.close()
+
+
+def split(n, nfiles, rng):
+    return np.concatenate([[0], np.sort(rng.randint(0, n + 1, nfiles - 1)), [n]])
+
+
+@pytest.fixture
+def sim(tmp_path):
+    """Subfind catalog (3 chunk files) and snapshot (3 chunk files) of 8 groups and 13 subhalos.
+
+    Particles of each type are stored group by group, each group with its subhalos first (in order)
+    and its fuzz after them, followed by particles outside of groups. A particle's ParticleIDs is
+    ID_OFFSET plus its index within its type, its Coordinates are that index three times.
+    """
+    rng = np.random.RandomState(42)
+    basedir = str(tmp_path)
+    GroupNsubs = np.array([3, 0, 2, 1, 0, 4, 1, 2], dtype="int32")
+    ngroups, nsubs = len(GroupNsubs), int(GroupNsubs.sum())
+    SubhaloLenType = np.zeros([nsubs, 6], dtype="int32")
+    GroupLenType = np.zeros([ngroups, 6], dtype="int32")
+    for parttype in PARTTYPES:
+        SubhaloLenType[:, parttype] = rng.randint(0, 7, nsubs)
+    SubhaloLenType[[1, 4, 9], 4] = 0
+    first = np.cumsum(GroupNsubs) - GroupNsubs
+    for num in range(ngroups):
+        GroupLenType[num] = SubhaloLenType[first[num]:first[num] + GroupNsubs[num]].sum(axis=0)
+        GroupLenType[num, PARTTYPES] += rng.randint(0, 4, len(PARTTYPES))
+    nall = GroupLenType.sum(axis=0) + np.array([5, 3, 0, 0, 2, 0])
+
+    os.makedirs(basedir + "/groups_%03d" % SNAPNUM)
+    gcut, scut = [0, 3, 5, 8], [0, 5, 9, 13]
+    for fnr in range(3):
+        gs, ss = slice(gcut[fnr], gcut[fnr + 1]), slice(scut[fnr], scut[fnr + 1])
+        header = {"Ngroups_ThisFile": gcut[fnr + 1] - gcut[fnr], "Nsubgroups_ThisFile": scut[fnr + 1] - scut[fnr], "NumFiles": 3,
+                  "Ngroups_Total": ngroups, "Nsubgroups_Total": nsubs, "Nids_Total": 0}
+        groups = {"Group": {"GroupLenType": GroupLenType[gs], "GroupNsubs": GroupNsubs[gs], "GroupFirstSub": np.where(GroupNsubs > 0, first, -1).astype("int32")[gs],
+                            "GroupMassType": GroupLenType[gs].astype("float32"), "GroupPos": rng.rand(gcut[fnr + 1] - gcut[fnr], 3).astype("float32")},
+                  "Subhalo": {"SubhaloLenType": SubhaloLenType[ss], "SubhaloGrNr": np.repeat(np.arange(ngroups), GroupNsubs).astype("int32")[ss],
+                              "SubhaloMass": SubhaloLenType[ss].sum(axis=1).astype("float32") + np.float32(0.1),
+                              "SubhaloPos": (np.arange(3 * nsubs, dtype="float32").reshape(-1, 3) / 3)[ss],
+                              "SubhaloIDMostbound": (ID_OFFSET + np.arange(nsubs)).astype("uint64")[ss]}}
+        write_file(basedir + "/groups_%03d/fof_subhalo_tab_%03d.%d.hdf5" % (SNAPNUM, SNAPNUM, fnr), header, groups)
+
+    os.makedirs(basedir + "/snapdir_%03d" % SNAPNUM)
+    cuts = dict([(parttype, split(nall[parttype], 3, rng)) for parttype in range(6)])
+    for fnr in range(3):
+        header = snapHDF5.snapshot_header()
+        header.massarr = np.array([0, 0.5, 0, 0, 0, 0], dtype="float64")
+        header.npart = np.array([cuts[parttype][fnr + 1] - cuts[parttype][fnr] for parttype in range(6)], dtype="int32")
+        header.nall = nall.astype("uint32")
+        header.filenum = 3
+        f = snapHDF5.openfile(basedir + "/snapdir_%03d/snap_%03d.%d.hdf5" % (SNAPNUM, SNAPNUM, fnr))
+        snapHDF5.writeheader(f, header)
+        for parttype in PARTTYPES:
+            index = np.arange(cuts[parttype][fnr], cuts[parttype][fnr + 1])
+            if len(index) > 0:
+                snapHDF5.write_block(f, "POS ", parttype, np.repeat(index[:, None], 3, axis=1).astype("float32"))
+                snapHDF5.write_block(f, "ID  ", parttype, (ID_OFFSET + index).astype("uint64"))
+        snapHDF5.closefile(f)
+
+    yield types.SimpleNamespace(basedir=basedir, snapnum=SNAPNUM, GroupLenType=GroupLenType, GroupNsubs=GroupNsubs,
+                                SubhaloLenType=SubhaloLenType, nall=nall)
+    snapHDF5.clear_index()
+    hdf5lib.CloseAll()
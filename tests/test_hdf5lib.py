@@ -0,0 +1,77 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import hdf5lib
+
+
+def write_array(filename, data):
+    f = hdf5lib.OpenFile(filename, mode="w")
+    group = hdf5lib.CreateGroup(f, "Data")
+    hdf5lib.CreateArray(f, group, "x", data)
+    f.close()
+
+
+def test_pooled_handles(tmp_path):
+    filename = str(tmp_path / "a.hdf5")
+    write_array(filename, np.arange(10))
+
+    with hdf5lib.OpenFile(filename) as f:
+        assert np.array_equal(hdf5lib.GetData(f, "Data/x")[:], np.arange(10))
+        with pytest.raises(IOError):
+            hdf5lib.OpenFile(filename, mode="a")
+        assert hdf5lib.InUse(filename)
+    assert not hdf5lib.InUse(filename)
+
+    #closed handles stay pooled, but do not block writing
+    write_array(filename, np.arange(5))
+    with hdf5lib.OpenFile(filename) as f:
+        assert np.array_equal(hdf5lib.GetData(f, "Data/x")[:], np.arange(5))
+
+
+def test_evicted_handle_in_use(tmp_path, monkeypatch):
+    monkeypatch.setattr(hdf5lib, "pool_size", 1)
+    names = [str(tmp_path / ("%d.hdf5" % num)) for num in range(3)]
+    for num, name in enumerate(names):
+        write_array(name, np.arange(num + 1))
+    f = hdf5lib.OpenFile(names[0])
+    for name in names[1:]:
+        hdf5lib.OpenFile(name).close()
+    hdf5lib.CloseFile(names[0])
+    assert os.path.abspath(names[0]) not in hdf5lib.pool
+    assert np.array_equal(hdf5lib.GetData(f, "Data/x")[:], np.arange(1))
+    assert hdf5lib.InUse(names[0])
+    f.close()
+    assert not hdf5lib.InUse(names[0])
+    assert len(hdf5lib.pool) <= 1
+    hdf5lib.CloseAll()
+
+
+def test_threaded_gzip_reads(tmp_path):
+    filename = str(tmp_path / "gzip.hdf5")
+    rng = np.random.RandomState(1)
+    arrays = {"pos": rng.rand(1000, 3).astype("float32"), "ids": np.arange(2**33, 2**33 + 1000, dtype="uint64"),
+              "flat": rng.rand(1000)}
+    f = hdf5lib.OpenFile(filename, mode="w")
+    group = hdf5lib.CreateGroup(f, "Data")
+    for name, shuffle in [("pos", True), ("ids", False), ("flat", True)]:
+        chunks = (64,) + arrays[name].shape[1:]
+        hdf5lib.CreateArray(f, group, name, arrays[name], chunks=chunks, compression="gzip", compression_opts=4, shuffle=shuffle)
+    hdf5lib.CreateArray(f, group, "plain", arrays["pos"])
+    f.close()
+
+    f = hdf5lib.OpenFile(filename)
+    for name in ["pos", "ids", "flat", "plain"]:
+        data = arrays["pos"] if (name == "plain") else arrays[name]
+        for start, stop in [(0, 1000), (0, 1), (63, 65), (100, 999), (500, 500), (960, 1000)]:
+            plain = hdf5lib.ReadData(f, "Data/" + name, start, stop, np.empty((stop - start,) + data.shape[1:], dtype=data.dtype))
+            for nthreads in [0, 2, 4]:
+                out = np.empty((stop - start,) + data.shape[1:], dtype=data.dtype)
+                hdf5lib.ReadDataThreaded(f, "Data/" + name, start, stop, out, nthreads)
+                assert np.array_equal(out, plain)
+                assert np.array_equal(out, data[start:stop])
+    f.close()
@@ -0,0 +1,147 @@
+import os
+
+import numpy as np
+import pytest
+
+import hdf5lib
+import mergertreeHDF5
+
+NSNAP = 10
+SKIPFAC = 1
+NTREES = [4, 3]
+NOT_IN_TREES = 2
+
+
+def make_tree(rng, totn):
+    snaps, desc, central, prev = [], [], [], []
+    for snap in range(NSNAP):
+        cur = list(range(len(snaps), len(snaps) + rng.randint(1, 4)))
+        central.append(cur[0])
+        snaps += [snap] * len(cur)
+        desc += [-1] * len(cur)
+        for h in prev:
+            if rng.rand() < 0.95:
+                desc[h] = cur[0] if rng.rand() < 0.8 else cur[rng.randint(len(cur))]
+        prev = cur
+    snaps, desc = np.array(snaps), np.array(desc)
+    nhalos = len(snaps)
+    lens = rng.randint(20, 5000, nhalos)
+    lens[central] += rng.randint(0, 5000, NSNAP)
+    first, nxt = -np.ones(nhalos, dtype="int32"), -np.ones(nhalos, dtype="int32")
+    for h in range(nhalos):
+        progs = np.where(desc == h)[0]
+        progs = progs[np.argsort(-lens[progs], kind="stable")]
+        if len(progs) > 0:
+            first[h] = progs[0]
+        for a, b in zip(progs[:-1], progs[1:]):
+            nxt[a] = b
+    subnum = np.zeros(nhalos, dtype="int32")
+    for h in range(nhalos):
+        subnum[h] = totn[snaps[h]]
+        totn[snaps[h]] += 1
+    masstype = np.zeros([nhalos, 6], dtype="float32")
+    masstype[:, 1] = lens * 0.01
+    masstype[:, 4] = rng.rand(nhalos) * lens * 0.001
+    masstype[rng.rand(nhalos) < 0.1, 4] = 0
+    lentype = np.zeros([nhalos, 6], dtype="int32")
+    lentype[:, 1] = lens
+    return {"SnapNum": snaps.astype("int32"), "Descendant": desc.astype("int32"), "FirstProgenitor": first, "NextProgenitor": nxt,
+            "FirstHaloInFOFGroup": np.arange(nhalos, dtype="int32"), "NextHaloInFOFGroup": -np.ones(nhalos, dtype="int32"),
+            "SubhaloNumber": subnum, "SubhaloLen": lens.astype("int32"), "SubhaloLenType": lentype, "SubhaloMassType": masstype}
+
+
+@pytest.fixture
+def trees(tmp_path, monkeypatch):
+    """LHaloTree files (2 files, 7 trees) of NSNAP snapshots; the last snapshot has NOT_IN_TREES subhalos outside of the trees."""
+    rng = np.random.RandomState(7)
+    basedir = str(tmp_path / "trees") + "/"
+    os.makedirs(basedir)
+    monkeypatch.setattr(mergertreeHDF5, "default_cachedir", str(tmp_path / "cache"))
+    totn = np.zeros(NSNAP, dtype="int32")
+    alltrees = [[make_tree(rng, totn) for ntree in range(NTREES[filenum])] for filenum in range(len(NTREES))]
+    totn[-1] += NOT_IN_TREES
+
+    for filenum in range(len(NTREES)):
+        f = hdf5lib.OpenFile(basedir + "trees_sf%d_%03d.%d.hdf5" % (SKIPFAC, NSNAP - 1, filenum), mode="w")
+        header = hdf5lib.CreateGroup(f, "Header")
+        hdf5lib.SetAttr(header, "NtreesPerFile", NTREES[filenum])
+        hdf5lib.SetAttr(header, "NumberOfOutputFiles", len(NTREES))
+        hdf5lib.SetAttr(header, "ParticleMass", 0.01)
+        hdf5lib.CreateArray(f, header, "TreeNHalos", np.array([len(tree["SnapNum"]) for tree in alltrees[filenum]], dtype="int32"))
+        hdf5lib.CreateArray(f, header, "TotNsubhalos", totn)
+        hdf5lib.CreateArray(f, header, "Redshifts", np.linspace(10, 0, NSNAP))
+        for ntree, tree in enumerate(alltrees[filenum]):
+            group = hdf5lib.CreateGroup(f, "Tree%d" % ntree)
+            for name in tree:
+                hdf5lib.CreateArray(f, group, name, tree[name])
+        f.close()
+    yield basedir, alltrees, totn
+    hdf5lib.CloseAll()
+
+
+def main_branch(tree, h):
+    branch = []
+    while h >= 0:
+        branch.append(h)
+        h = tree["FirstProgenitor"][h]
+    return branch
+
+
+#(snapshot of the descendant, stellar mass ratio) of every merger onto the main branch of halo h
+def brute_force_mergers(tree, h, ratio_at):
+    mstar = tree["SubhaloMassType"][:, 4]
+    main = main_branch(tree, h)
+    main_by_snap = dict((tree["SnapNum"][k], k) for k in main)
+    mergers = []
+    for desc in main:
+        prog = tree["NextProgenitor"][tree["FirstProgenitor"][desc]] if tree["FirstProgenitor"][desc] >= 0 else -1
+        while prog >= 0:
+            if ratio_at == "merger":
+                m_sec, m_prim = mstar[prog], mstar[tree["FirstProgenitor"][desc]]
+            else:
+                #largest mass along the secondary's main branch, the earliest one on ties
+                branch = main_branch(tree, prog)[::-1]
+                top = branch[0]
+                for k in branch:
+                    if mstar[k] > mstar[top]:
+                        top = k
+                m_sec = mstar[top]
+                m_prim = mstar[main_by_snap[tree["SnapNum"][top]]] if tree["SnapNum"][top] in main_by_snap else 0
+            m_max = max(m_sec, m_prim)
+            mergers.append((tree["SnapNum"][desc], min(m_sec, m_prim) / m_max if m_max > 0 else 0))
+            prog = tree["NextProgenitor"][prog]
+    return mergers
+
+
+@pytest.mark.parametrize("ratio_at", ["max", "merger"])
+def test_summary_matches_brute_force(trees, ratio_at, tmp_path):
+    basedir, alltrees, totn = trees
+    ratios, snap_cutoffs = (0.5, 0.25, 0.1), (2, 6)
+    subhalo_nums = np.arange(totn[-1])[::-1]
+    columns = mergertreeHDF5.merger_summary(basedir, SKIPFAC, NSNAP - 1, subhalo_nums, ratios=ratios, snap_cutoffs=snap_cutoffs,
+                                            ratio_at=ratio_at, outfile=str(tmp_path / "summary.npz"))
+
+    expected = dict((summary_key, np.zeros(len(subhalo_nums), dtype="int32"))
+                    for summary_key in [mergertreeHDF5.summary_column(r, s) for r in ratios for s in snap_cutoffs])
+    intrees = np.zeros(len(subhalo_nums), dtype=bool)
+    nmergers = 0
+    for tree in [tree for filetrees in alltrees for tree in filetrees]:
+        for h in np.where(tree["SnapNum"] == NSNAP - 1)[0]:
+            i = np.where(subhalo_nums == tree["SubhaloNumber"][h])[0][0]
+            intrees[i] = True
+            mergers = brute_force_mergers(tree, h, ratio_at)
+            nmergers += len(mergers)
+            for r in ratios:
+                for s in snap_cutoffs:
+                    expected[mergertreeHDF5.summary_column(r, s)][i] = sum(1 for snap, ratio in mergers if (ratio > r) & (snap > s))
+
+    assert nmergers > 0
+    assert intrees.sum() == totn[-1] - NOT_IN_TREES
+    assert np.array_equal(columns["SubhaloNumber"], subhalo_nums)
+    assert np.array_equal(columns["InTrees"], intrees)
+    saved = np.load(str(tmp_path / "summary.npz"))
+    for key in expected:
+        assert np.array_equal(columns[key], expected[key]), key
+        assert np.array_equal(saved[key], expected[key]), key
+    assert sorted(os.listdir(basedir)) == ["trees_sf1_009.0.hdf5", "trees_sf1_009.1.hdf5"]
+    assert os.path.exists(mergertreeHDF5.merger_tree(basedir, SKIPFAC, NSNAP - 1).lookup_cachedir() + "/SubhaloLookup_009.dat")
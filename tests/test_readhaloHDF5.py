@@ -0,0 +1,76 @@
+import os
+
+import numpy as np
+import pytest
+
+import hdf5lib
+import readhaloHDF5
+from conftest import ID_OFFSET
+
+
+def subhalo_offsets(sim):
+    offsets = np.zeros(sim.SubhaloLenType.shape, dtype="int64")
+    group_start = np.zeros(6, dtype="int64")
+    sub = 0
+    for num in range(len(sim.GroupNsubs)):
+        start = group_start.copy()
+        for i in range(sim.GroupNsubs[num]):
+            offsets[sub] = start
+            start += sim.SubhaloLenType[sub]
+            sub += 1
+        group_start += sim.GroupLenType[num]
+    return offsets
+
+
+def test_construct_offsets(sim):
+    GroupOffset, HaloOffset = readhaloHDF5.construct_offsets(sim.GroupLenType, sim.GroupNsubs, sim.SubhaloLenType)
+    assert np.array_equal(GroupOffset[1:], np.cumsum(sim.GroupLenType, axis=0)[:-1])
+    assert np.array_equal(GroupOffset[0], np.zeros(6))
+    assert np.array_equal(HaloOffset, subhalo_offsets(sim))
+
+
+def test_offset_cache(sim, tmp_path):
+    cachedir = str(tmp_path / "cache")
+    reader = readhaloHDF5.SnapshotHaloReader(sim.basedir, sim.snapnum, long_ids=True, cachedir=cachedir)
+    reader.load()
+    assert np.array_equal(reader.HaloOffset, subhalo_offsets(sim))
+    cachename = reader.get_cachename()
+    assert os.path.exists(cachename) and os.path.exists(cachename + ".sig.npy")
+
+    #mapped from the cache while the catalog is unchanged, rebuilt once it changes
+    signature = hdf5lib.FileSignature(reader.cat.curfiles)
+    offsets = readhaloHDF5.load_offset_cache(cachename, reader.cat.ngroups + reader.cat.nsubs, signature)
+    assert isinstance(offsets, np.memmap)
+    assert np.array_equal(offsets[reader.cat.ngroups:], subhalo_offsets(sim))
+    signature[0][1] += 1
+    assert readhaloHDF5.load_offset_cache(cachename, reader.cat.ngroups + reader.cat.nsubs, signature) is None
+    assert readhaloHDF5.load_offset_cache(cachename, reader.cat.ngroups + reader.cat.nsubs + 1, hdf5lib.FileSignature(reader.cat.curfiles)) is None
+
+    reader = readhaloHDF5.SnapshotHaloReader(sim.basedir, sim.snapnum, long_ids=True, cachedir=cachedir)
+    reader.load()
+    assert isinstance(reader.HaloOffset, np.memmap)
+    assert np.array_equal(reader.HaloOffset, subhalo_offsets(sim))
+
+
+def test_sweep_order_and_empty_subhalos(sim):
+    reader = readhaloHDF5.SnapshotHaloReader(sim.basedir, sim.snapnum, long_ids=True, cachedir=None)
+    offsets = subhalo_offsets(sim)
+    sub_nums = np.array([12, 1, 7, 4, 0, 9, 3])
+    sweep = list(reader.iter_subhalos(4, sub_nums, ["ID  ", "POS "], max_gap=2))
+    assert [num for num, data in sweep] == sorted(sub_nums)
+    for num, data in sweep:
+        if sim.SubhaloLenType[num, 4] == 0:
+            assert data is None
+        else:
+            ids = ID_OFFSET + offsets[num, 4] + np.arange(sim.SubhaloLenType[num, 4])
+            assert np.array_equal(data["ID  "], ids)
+            assert np.array_equal(data["POS "][:, 0], ids - ID_OFFSET)
+    assert [num for num, data in sweep if data is None] == [1, 4, 9]
+
+
+def test_next_subhalo_checks_the_loop(sim):
+    reader = readhaloHDF5.SnapshotHaloReader(sim.basedir, sim.snapnum, long_ids=True, cachedir=None)
+    sweep = reader.iter_subhalos(0, [5, 2], ["ID  "], out={})
+    assert readhaloHDF5.next_subhalo(sweep, 2) is not None
+    with pytest.raises(ValueError):
+        readhaloHDF5.next_subhalo(sweep, 6)
@@ -0,0 +1,83 @@
+import json
+import os
+
+import numpy as np
+
+import hdf5lib
+import readsubfHDF5
+from conftest import ID_OFFSET
+
+
+def test_consolidated_columns_keep_long_ids(sim, tmp_path):
+    outdir = str(tmp_path / "columns")
+    readsubfHDF5.consolidate(sim.basedir, sim.snapnum, outdir=outdir)
+    for long_ids in [True, False]:
+        cat = readsubfHDF5.subfind_catalog(sim.basedir, sim.snapnum, long_ids=long_ids, columns=outdir)
+        ref = readsubfHDF5.subfind_catalog(sim.basedir, sim.snapnum, long_ids=long_ids, columns=False)
+        assert cat.SubhaloIDMostbound.dtype == ref.SubhaloIDMostbound.dtype
+        assert np.array_equal(cat.SubhaloIDMostbound, ref.SubhaloIDMostbound)
+
+    #float columns are stored as the float64 the catalog returns, and mapped
+    cat = readsubfHDF5.subfind_catalog(sim.basedir, sim.snapnum, long_ids=True, columns=outdir)
+    assert isinstance(cat.SubhaloPos, np.memmap)
+    assert cat.SubhaloPos.dtype == np.float64
+    assert isinstance(cat.SubhaloIDMostbound, np.memmap)
+    assert cat.SubhaloIDMostbound[-1] == ID_OFFSET + len(cat.SubhaloIDMostbound) - 1
+
+
+def test_truncated_columns_are_not_used(sim, tmp_path):
+    outdir = str(tmp_path / "columns")
+    readsubfHDF5.consolidate(sim.basedir, sim.snapnum, outdir=outdir, keys=["SubhaloIDMostbound"])
+
+    #a column truncated to uint32 by an older version, without the dtype of the chunk files
+    with open(outdir + "/manifest.json") as f:
+        manifest = json.load(f)
+    entry = manifest["fields"]["SubhaloIDMostbound"]
+    np.save(outdir + "/" + entry["file"], np.load(outdir + "/" + entry["file"]).astype("uint32"))
+    entry["dtype"] = np.dtype("uint32").str
+    del entry["file_dtype"]
+    with open(outdir + "/manifest.json", "w") as f:
+        json.dump(manifest, f)
+
+    cat = readsubfHDF5.subfind_catalog(sim.basedir, sim.snapnum, long_ids=True, columns=outdir)
+    assert cat.SubhaloIDMostbound[0] == ID_OFFSET
+    lazy = readsubfHDF5.lazy_subfind_catalog(sim.basedir, sim.snapnum, long_ids=True, columns=outdir, cachedir=None)
+    assert np.array_equal(lazy.get_rows("SubhaloIDMostbound", [2, 0]), ID_OFFSET + np.array([2, 0]))
+    assert lazy.SubhaloIDMostbound[0] == ID_OFFSET
+
+
+def test_field_cache_follows_catalog(sim, tmp_path):
+    cachedir = str(tmp_path / "cache")
+    cat = readsubfHDF5.lazy_subfind_catalog(sim.basedir, sim.snapnum, cachedir=cachedir, columns=False)
+    mass = np.array(cat.SubhaloMass)
+    cat = readsubfHDF5.lazy_subfind_catalog(sim.basedir, sim.snapnum, cachedir=cachedir, columns=False)
+    assert isinstance(cat.SubhaloMass, np.memmap)
+    assert np.array_equal(cat.SubhaloMass, mass)
+
+    #regenerate the catalog with the same number of subhalos and other masses
+    filename = sim.basedir + "/groups_%03d/fof_subhalo_tab_%03d.1.hdf5" % (sim.snapnum, sim.snapnum)
+    f = hdf5lib.OpenFile(filename, mode="a")
+    data = hdf5lib.GetData(f, "Subhalo/SubhaloMass")
+    data[:] = data[:] + 100
+    f.close()
+    os.utime(filename, ns=(0, os.stat(filename).st_mtime_ns + 10**9))
+
+    cat = readsubfHDF5.lazy_subfind_catalog(sim.basedir, sim.snapnum, cachedir=cachedir, columns=False)
+    assert np.array_equal(cat.SubhaloMass[:5], mass[:5])
+    assert np.allclose(cat.SubhaloMass[5:9], mass[5:9] + 100)
+
+
+def test_rows_spanning_files(sim):
+    ref = readsubfHDF5.subfind_catalog(sim.basedir, sim.snapnum, long_ids=True, columns=False)
+    #subhalo files hold rows 0-4, 5-8 and 9-12, group files rows 0-2, 3-4 and 5-7
+    rows = np.array([12, 0, 5, 4, 9, 5, 8])
+    cat = readsubfHDF5.lazy_subfind_catalog(sim.basedir, sim.snapnum, long_ids=True, columns=False)
+    assert np.array_equal(cat.get_rows("SubhaloLenType", rows), ref.SubhaloLenType[rows])
+    assert np.array_equal(cat.get_rows("SubhaloIDMostbound", rows), ref.SubhaloIDMostbound[rows])
+    assert np.array_equal(cat.get_rows("GroupPos", [7, 2, 3]), ref.GroupPos[[7, 2, 3]])
+    assert cat.get_rows("SubhaloPos", np.zeros(0, dtype="int64")).shape == (0, 3)
+    assert np.array_equal(cat.get_rows("SubhaloMass", rows.reshape(-1, 1)), ref.SubhaloMass[rows.reshape(-1, 1)])
+
+    sub = readsubfHDF5.subfind_catalog(sim.basedir, sim.snapnum, long_ids=True, columns=False, subhalo_rows=rows, group_rows=[4, 3])
+    assert np.array_equal(sub.SubhaloPos, ref.SubhaloPos[rows])
+    assert np.array_equal(sub.GroupNsubs, ref.GroupNsubs[[4, 3]])
@@ -0,0 +1,120 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import hdf5lib
+import snapHDF5
+
+
+def write_snapshot(filename, pos, ids):
+    header = snapHDF5.snapshot_header()
+    header.massarr = np.zeros(6, dtype="float64")
+    header.npart[4] = len(pos)
+    header.nall[4] = len(pos)
+    f = snapHDF5.openfile(filename)
+    snapHDF5.writeheader(f, header)
+    snapHDF5.write_block(f, "POS ", 4, pos)
+    snapHDF5.write_block(f, "ID  ", 4, ids)
+    snapHDF5.closefile(f)
+
+
+def test_read_after_rewrite(tmp_path):
+    base = str(tmp_path / "snap_000")
+    pos = np.arange(30, dtype="float32").reshape(10, 3)
+    write_snapshot(base + ".hdf5", pos, np.arange(10, dtype="uint64"))
+    assert np.array_equal(snapHDF5.read_block(base, "POS ", parttype=4), pos)
+
+    pos = np.arange(60, dtype="float32").reshape(20, 3) + 100
+    write_snapshot(base + ".hdf5", pos, np.arange(20, dtype="uint64"))
+    assert np.array_equal(snapHDF5.read_block(base, "POS ", parttype=4), pos)
+    assert np.array_equal(snapHDF5.read_block(base, "ID  ", parttype=4), np.arange(20))
+
+
+def test_read_after_external_rewrite(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapHDF5, "index_check_interval", 0)
+    base = str(tmp_path / "snap_000")
+    pos = np.arange(30, dtype="float32").reshape(10, 3)
+    write_snapshot(base + ".hdf5", pos, np.arange(10, dtype="uint64"))
+    assert np.array_equal(snapHDF5.read_block(base, "POS ", parttype=4), pos)
+    assert not snapHDF5.contains_block(base, "MASS", 4)
+
+    #replaced behind the reader's back, e.g. by another process
+    pos = np.arange(60, dtype="float32").reshape(20, 3) + 100
+    write_snapshot(str(tmp_path / "new.hdf5"), pos, np.arange(20, dtype="uint64"))
+    os.replace(str(tmp_path / "new.hdf5"), base + ".hdf5")
+    assert np.array_equal(snapHDF5.read_block(base, "POS ", parttype=4), pos)
+    assert np.array_equal(snapHDF5.read_block(base, "ID  ", parttype=4), np.arange(20))
+
+
+def test_append_updates_header(tmp_path):
+    filename = str(tmp_path / "snap_000.hdf5")
+    pos = np.arange(60, dtype="float32").reshape(20, 3)
+    header = snapHDF5.snapshot_header()
+    header.massarr = np.zeros(6, dtype="float64")
+    f = snapHDF5.openfile(filename)
+    snapHDF5.writeheader(f, header)
+    snapHDF5.write_block(f, "POS ", 4, pos[:5], append=True)
+    snapHDF5.write_block(f, "POS ", 4, pos[5:], append=True)
+    snapHDF5.closefile(f)
+
+    header = snapHDF5.snapshot_header(filename)
+    assert header.npart[4] == 20
+    assert header.nall[4] == 20
+    assert np.array_equal(snapHDF5.read_block(filename, "POS ", parttype=4), pos)
+
+    f = snapHDF5.openfile(filename, mode="a")
+    snapHDF5.write_block(f, "POS ", 4, pos, append=True)
+    snapHDF5.closefile(f)
+    assert snapHDF5.snapshot_header(filename).nall[4] == 40
+    assert np.array_equal(snapHDF5.read_block(filename, "POS ", parttype=4), np.concatenate([pos, pos]))
+
+
+def test_index_checks_are_throttled(sim, monkeypatch):
+    base = sim.basedir + "/snapdir_%03d/snap_%03d" % (sim.snapnum, sim.snapnum)
+    snapHDF5.get_index(base)
+    calls = []
+    get_signature = snapHDF5.snapshot_index.get_signature
+    get_attr = hdf5lib.GetAttr
+    monkeypatch.setattr(snapHDF5.snapshot_index, "get_signature", lambda self: calls.append("signature") or get_signature(self))
+    monkeypatch.setattr(hdf5lib, "GetAttr", lambda *args: calls.append("header") or get_attr(*args))
+
+    #chunk headers come from the index, and the chunk files are not checked again within the interval
+    for num in range(3):
+        snapHDF5.read_blocks_single_file(base + "." + str(num), ["POS "], 4)
+        assert snapHDF5.read_blocks_layout(base + "." + str(num), ["POS "], 4)["POS "][1] == (3,)
+    assert len(snapHDF5.read_block(base, "ID  ", parttype=4)) == sim.nall[4]
+    assert calls == []
+
+    monkeypatch.setattr(snapHDF5, "index_check_interval", 0)
+    assert len(snapHDF5.read_block(base, "ID  ", parttype=4)) == sim.nall[4]
+    assert calls == ["signature"]
+
+
+def test_read_particles_across_files(sim):
+    base = sim.basedir + "/snapdir_%03d/snap_%03d" % (sim.snapnum, sim.snapnum)
+    index, num = snapHDF5.get_index(base)
+    assert (index.npart[:, 0] > 0).sum() > 1
+    ids = snapHDF5.read_block(base, "ID  ", parttype=0)
+    pos = snapHDF5.read_block(base, "POS ", parttype=0)
+
+    #repeats, both ends and every chunk boundary, read as few runs and as single rows
+    bounds = np.cumsum(index.npart[:, 0])
+    indices = np.unique(np.concatenate([[0, 0, len(ids) - 1], bounds[:-1] - 1, bounds[:-1], np.arange(3, len(ids), 7)]))
+    indices = np.sort(np.concatenate([indices, indices[:3]]))
+    for max_gap in [0, 5, 1000]:
+        assert np.array_equal(snapHDF5.read_particles(base, "ID  ", 0, indices, max_gap=max_gap), ids[indices])
+        assert np.array_equal(snapHDF5.read_particles(base, "POS ", 0, indices, max_gap=max_gap), pos[indices])
+
+    #masses of a MassTable type, into a caller's buffer
+    out = np.zeros(len(indices) + 2)
+    mass = snapHDF5.read_particles(base, "MASS", 1, indices[indices < sim.nall[1]], out=out)
+    assert np.all(mass == 0.5)
+
+    #indices within one chunk file
+    chunk = base + ".1"
+    ids1 = snapHDF5.read_block(chunk, "ID  ", parttype=0)
+    assert np.array_equal(snapHDF5.read_particles(chunk, "ID  ", 0, [0, len(ids1) - 1]), ids1[[0, -1]])
+    assert len(snapHDF5.read_particles(base, "ID  ", 0, [])) == 0